@@ -0,0 +1,171 @@
+# Microbenchmarks for the result conversion and call dispatch hot paths of the DataSHIELD plugin.
+# They run offline: R is needed (with jsonlite installed) to build the synthetic R objects, but no
+# DataSHIELD server is contacted, and the R executor is replaced by a stub for the dispatch benchmarks.
+# python benchmarks/benchmark.py --output benchmark.json
+# The JSON output lists the best and mean time per call of every benchmark and size, so that the
+# files written for two releases can be compared directly.
+
+import argparse
+import json
+import platform
+import sys
+import time
+import timeit
+from concurrent.futures import Future
+
+from fdrtd.plugins.datashield import executor, helpers, runtime
+
+sizes = (10, 1000, 100000)
+
+r_objects = {
+    'vector': 'function(n) { x <- rnorm(n); x[seq(1, n, by=10)] <- NA; x }',
+    'matrix': 'function(n) { k <- max(n %/% 10, 1); matrix(rnorm(k * 10), ncol=10, '
+              'dimnames=list(paste0("row", seq_len(k)), paste0("col", seq_len(10)))) }',
+    'data.frame': 'function(n) data.frame(x=rnorm(n), y=sample(letters, n, TRUE), z=seq_len(n), '
+                  'w=sample(c(TRUE, FALSE, NA), n, TRUE), stringsAsFactors=FALSE)',
+    'nested list': 'function(n) { k <- max(n %/% 10, 1); setNames(lapply(seq_len(k), function(i) '
+                   'list(mean=i / 2, n=i, quantiles=quantile(seq_len(i)), names=letters[1:3])), '
+                   'paste0("study", seq_len(k))) }'
+}
+
+login_parameters = {'assign': True, 'symbol': 'D', 'variables': ['LAB_HDL', 'LAB_TSC', 'GENDER'],
+                    'missings': False, 'id_name': 'id', 'restore': 'workspace'}
+
+
+class StubExecutor:
+
+    formals = {
+        'ds.mean': ['x', 'type', 'checks', 'save.mean.Nstudies', 'datasources'],
+        'ds.ls': ['search.filter', 'env.to.search', 'search.GlobalEnv', 'datasources'],
+        'ds.assign': ['toAssign', 'newobj', 'datasources'],
+        'ds.histogram': ['x', 'type', 'num.breaks', 'method', 'k', 'noise', 'vertical.axis', 'datasources']
+    }
+
+    def submit(self, job, *args, console=None, pin=None, among=None):
+        future = Future()
+        future.set_result(self.result(job, *args))
+        return future
+
+    def result(self, job, *args):
+        if job == 'after_steps':
+            return self.result(args[2], args[0], *args[3:])
+        if job == 'list_formals':
+            return self.formals
+        if job == 'call_batch':
+            return [None] * len(args[1])
+        if job == 'call_function_per_server':
+            return {'servers': [], 'result': None}
+        return None
+
+    def release(self, pin):
+        return None
+
+    def pinned_worker(self, pin):
+        return 0
+
+    def worker_index(self, future):
+        return 0
+
+    def get_status(self):
+        return {}
+
+
+def measure(results, name, size, statement, repeat, min_time):
+    timer = timeit.Timer(statement)
+    number, _ = timer.autorange()
+    number = max(number, int(number * min_time / 0.2))
+    times = [elapsed / number for elapsed in timer.repeat(repeat=repeat, number=number)]
+    results.append({'name': name, 'size': size, 'number': number, 'repeat': repeat,
+                    'best': min(times), 'mean': sum(times) / len(times)})
+    print(f'{name:40} {str(size):>8} {min(times) * 1e6:14.2f} us', file=sys.stderr)
+
+
+def conversion_benchmarks(results, repeat, min_time):
+    r = runtime.robjects().r
+    r('set.seed(1)')
+    for kind, constructor in r_objects.items():
+        for size in sizes:
+            output = r(constructor)(size)
+            serialized = helpers.jsonlite_R.serializeJSON(output)[0]
+            parsed = json.loads(serialized)
+            swept = helpers.first_sweep(json.loads(serialized))
+            measure(results, f'serializeJSON {kind}', size,
+                    lambda: helpers.jsonlite_R.serializeJSON(output), repeat, min_time)
+            measure(results, f'first_sweep {kind}', size, lambda: helpers.first_sweep(parsed), repeat, min_time)
+            measure(results, f'second_sweep {kind}', size, lambda: helpers.second_sweep(swept), repeat, min_time)
+            measure(results, f'r_to_json via JSON {kind}', size,
+                    lambda: helpers.r_to_json(output, False, via_json=True), repeat, min_time)
+            measure(results, f'r_to_json native {kind}', size, lambda: helpers.r_to_json(output, False),
+                    repeat, min_time)
+            if kind != 'nested list':
+                measure(results, f'r_to_columnar {kind}', size, lambda: helpers.r_to_columnar(output),
+                        repeat, min_time)
+
+
+def parameter_benchmarks(results, repeat, min_time):
+    mean = runtime.package('dsBaseClient').ds_mean
+    plan = helpers.call_plan(mean)
+    parameters = {'x': 'D$LAB_HDL', 'type': 'combine', 'save_mean_Nstudies': False}
+    measure(results, 'defaults ds.mean', None, lambda: helpers.defaults(mean, dict(parameters)), repeat, min_time)
+    measure(results, 'plan_parameters ds.mean', None, lambda: helpers.plan_parameters(plan, parameters),
+            repeat, min_time)
+    measure(results, 'login_params_string_builder', None,
+            lambda: helpers.login_params_string_builder(login_parameters), repeat, min_time)
+
+
+def check_finished(connection, name):
+    status = connection.get_status({'connection': 'benchmark'})
+    if status['busy']:
+        raise RuntimeError(f"{name}: {status['in_flight']} calls did not finish")
+
+
+def dispatch_benchmarks(results, repeat, min_time):
+    from fdrtd.plugins.datashield.connection import Connection
+    executor.r_executor = StubExecutor()
+    connection = Connection(None, 'benchmark')
+    connection.connect({'session': 'benchmark', 'symbol': 'sessionbenchmark', 'pooled': False}, 'benchmark')
+    benchmarks = {
+        'call_function ds.mean': lambda: connection.call_function({'connection': 'benchmark'}, 'ds.mean',
+                                                                  {'x': 'D$LAB_HDL'}),
+        'call_function ds.assign': lambda: connection.call_function({'connection': 'benchmark'}, 'ds.assign',
+                                                                    {'toAssign': 'D$LAB_HDL', 'newobj': 'hdl'}),
+        'call_batch 3 steps': lambda: connection.call_batch({'connection': 'benchmark'}, [
+            {'func': 'ds.assign', 'parameters': {'toAssign': 'D$LAB_HDL', 'newobj': 'hdl'}},
+            {'func': 'ds.mean', 'parameters': {'x': 'hdl'}},
+            {'func': 'ds.ls', 'parameters': {}}
+        ])
+    }
+    for name, statement in benchmarks.items():
+        measure(results, name, None, statement, repeat, min_time)
+        check_finished(connection, name)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='microbenchmarks of the fdrtd DataSHIELD plugin')
+    parser.add_argument('--output', help='file to write the JSON results to (default: stdout)')
+    parser.add_argument('--repeat', type=int, default=5, help='number of timing runs per benchmark')
+    parser.add_argument('--min-time', type=float, default=0.2, help='minimum seconds per timing run')
+    parser.add_argument('--only', choices=('conversion', 'parameters', 'dispatch'), action='append',
+                        help='run only these groups of benchmarks')
+    arguments = parser.parse_args()
+    groups = {'conversion': conversion_benchmarks, 'parameters': parameter_benchmarks,
+              'dispatch': dispatch_benchmarks}
+    results = []
+    for group in arguments.only or groups:
+        groups[group](results, arguments.repeat, arguments.min_time)
+    report = {
+        'timestamp': time.time(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'R': str(runtime.robjects().r('R.version.string')[0]) if runtime.timings else None,
+        'results': results
+    }
+    if arguments.output is None:
+        json.dump(report, sys.stdout, indent=2)
+    else:
+        with open(arguments.output, 'w') as file:
+            json.dump(report, file, indent=2)
+
+
+if __name__ == '__main__':
+    main()
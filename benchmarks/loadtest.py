@@ -0,0 +1,242 @@
+# Load test of the DataSHIELD plugin with many concurrent simulated clients.
+# It runs offline: the studies are DSLite servers inside the local R (DSI, DSLite, dsBase and
+# dsBaseClient need to be installed) holding synthetic CNSIM-like tables, so no Opal is contacted.
+# python benchmarks/loadtest.py --clients 16 --duration 120 --latency 0.2 --output loadtest.json
+# Every client logs in, runs a random mix of aggregate, assign and plot functions and logs out, over
+# and over. The JSON output has the latency percentiles and throughput per kind of request and, every
+# --interval seconds, a sample of throughput, latency, thread count, R heap and process RSS.
+
+import argparse
+import json
+import platform
+import random
+import resource
+import sys
+import threading
+import time
+
+from fdrtd.plugins.datashield import runtime, settings
+from fdrtd.plugins.datashield.connection import Connection
+from fdrtd.plugins.datashield.executor import get_executor
+from fdrtd.plugins.datashield.login import Login
+
+workload = (
+    ('aggregate', 'ds.mean', {'x': 'D$LAB_HDL'}, 4),
+    ('aggregate', 'ds.quantileMean', {'x': 'D$LAB_TSC'}, 2),
+    ('aggregate', 'ds.dim', {'x': 'D'}, 2),
+    ('aggregate', 'ds.table', {'rvar': 'D$GENDER'}, 1),
+    ('assign', 'ds.assign', {'toAssign': 'D$LAB_HDL', 'newobj': 'hdl'}, 2),
+    ('assign', 'ds.log', {'x': 'D$LAB_TRIG', 'newobj': 'trig_log'}, 1),
+    ('plot', 'ds.histogram', {'x': 'D$LAB_HDL'}, 1)
+)
+
+table_R = '''function(n) data.frame(
+    LAB_TSC=rnorm(n, 5.8, 1.1), LAB_TRIG=rlnorm(n, 0.4, 0.5), LAB_HDL=rnorm(n, 1.6, 0.4),
+    LAB_GLUC_ADJUSTED=rnorm(n, 6, 1), PM_BMI_CONTINUOUS=rnorm(n, 26, 4),
+    DIS_CVA=factor(rbinom(n, 1, 0.02)), MEDI_LPD=factor(rbinom(n, 1, 0.05)), DIS_DIAB=factor(rbinom(n, 1, 0.03)),
+    DIS_AMI=factor(rbinom(n, 1, 0.03)), GENDER=factor(rbinom(n, 1, 0.5)),
+    PM_BMI_CATEGORICAL=factor(sample(1:3, n, TRUE))
+)'''
+
+latency_R = '''function(server, seconds) {
+    for (name in c("aggregate", "assignExpr", "assignTable")) {
+        unlockBinding(name, server)
+        assign(name, local({ method <- server[[name]]; function(...) { Sys.sleep(seconds); method(...) } }),
+               envir=server)
+        lockBinding(name, server)
+    }
+}'''
+
+
+class LocalBus:
+
+    def __init__(self):
+        self.connection = Connection(self, 'connection')
+
+    def select_microservice(self, requirements):
+        return 'connection'
+
+    def call_microservice(self, handle, function, parameters):
+        return getattr(self.connection, function)(**parameters)
+
+
+class Recorder:
+
+    def __init__(self):
+        self.events = []
+        self.lock = threading.Lock()
+
+    def add(self, kind, start, error):
+        with self.lock:
+            self.events.append({'kind': kind, 'finished': time.monotonic(), 'latency': time.monotonic() - start,
+                                'error': error})
+
+    def since(self, start):
+        with self.lock:
+            return [event for event in self.events if event['finished'] >= start]
+
+
+def percentile(values, fraction):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(int(fraction * len(values)), len(values) - 1)]
+
+
+def summary(events, seconds):
+    latencies = [event['latency'] for event in events if event['error'] is None]
+    return {'count': len(events), 'errors': sum(1 for event in events if event['error'] is not None),
+            'throughput': len(events) / seconds if seconds > 0 else None, 'p50': percentile(latencies, 0.5),
+            'p95': percentile(latencies, 0.95), 'p99': percentile(latencies, 0.99)}
+
+
+def rss():
+    try:
+        with open('/proc/self/status') as status:
+            for line in status:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def start_servers(studies, rows, latencies, seed):
+    r = runtime.robjects().r
+    runtime.package('DSLite')
+    r('set.seed(%d)' % seed)
+    servers = []
+    for index in range(studies):
+        name = f'study{index + 1}'
+        runtime.robjects().globalenv['loadtest.table'] = r(table_R)(rows)
+        r(f'loadtest.{name} <- DSLite::newDSLiteServer(tables=list(CNSIM=loadtest.table), '
+          'config=DSLite::defaultDSConfiguration(include=c("dsBase")))')
+        if latencies.get(name, 0) > 0:
+            r(latency_R)(r(f'loadtest.{name}'), latencies[name])
+        servers.append({'server': name, 'url': f'loadtest.{name}', 'table': 'CNSIM', 'driver': 'DSLiteDriver'})
+    return servers
+
+
+def wait(get_status, timeout):
+    status = {'busy': True, 'cursor': {}}
+    deadline = time.monotonic() + timeout
+    while status['busy']:
+        if time.monotonic() > deadline:
+            raise TimeoutError(f'no answer within {timeout} seconds')
+        status = get_status(cursor=status['cursor'], timeout=10)
+    return status
+
+
+def client(login, servers, arguments, recorder, stop, seed):
+    rng = random.Random(seed)
+    weights = [weight for _, _, _, weight in workload]
+    while not stop.is_set():
+        start = time.monotonic()
+        try:
+            uuid = login.login(list_of_servers=servers, assign=True, symbol='D')['callback']
+            status = wait(lambda **kwargs: login.get_status(uuid, **kwargs), arguments.timeout)
+            if 'error' in status:
+                raise RuntimeError(status['error'])
+            connection = login.get_result(uuid)['callback']
+        except Exception as err:
+            recorder.add('login', start, str(err))
+            continue
+        recorder.add('login', start, None)
+        for _ in range(arguments.calls):
+            if stop.is_set():
+                break
+            kind, func, parameters, _ = rng.choices(workload, weights)[0]
+            start = time.monotonic()
+            try:
+                callback = login.bus.connection.call_function(dict(connection), func, dict(parameters))['callback']
+                status = wait(lambda **kwargs: login.bus.connection.get_status(callback, **kwargs), arguments.timeout)
+                recorder.add(kind, start, status.get('error'))
+            except Exception as err:
+                recorder.add(kind, start, str(err))
+        start = time.monotonic()
+        try:
+            callback = login.bus.connection.logout(dict(connection))['callback']
+            status = wait(lambda **kwargs: login.bus.connection.get_status(callback, **kwargs), arguments.timeout)
+            recorder.add('logout', start, status.get('error'))
+        except Exception as err:
+            recorder.add('logout', start, str(err))
+
+
+def sample(recorder, started, interval, samples, stop):
+    previous = time.monotonic()
+    while not stop.wait(interval):
+        now = time.monotonic()
+        try:
+            heap = get_executor().submit('heap_size').result(timeout=interval)
+        except Exception:
+            heap = None
+        samples.append(dict(summary(recorder.since(previous), now - previous), time=now - started,
+                            threads=threading.active_count(), rss=rss(), r_heap=heap))
+        print(f"{now - started:8.1f} s {samples[-1]['throughput']:8.2f}/s p95 {samples[-1]['p95']} "
+              f"threads {samples[-1]['threads']} rss {samples[-1]['rss']}", file=sys.stderr)
+        previous = now
+
+
+def main():
+    parser = argparse.ArgumentParser(description='concurrent load test of the fdrtd DataSHIELD plugin')
+    parser.add_argument('--output', help='file to write the JSON results to (default: stdout)')
+    parser.add_argument('--clients', type=int, default=8, help='number of concurrent simulated clients')
+    parser.add_argument('--duration', type=float, default=60, help='seconds to run the load for')
+    parser.add_argument('--calls', type=int, default=20, help='calls per session between login and logout')
+    parser.add_argument('--studies', type=int, default=3, help='number of DSLite servers')
+    parser.add_argument('--rows', type=int, default=2000, help='rows of the synthetic table of every study')
+    parser.add_argument('--latency', default='0',
+                        help='seconds added to every server request, either one value for all studies '
+                             'or a list like study1=0.1,study2=0.5')
+    parser.add_argument('--interval', type=float, default=5, help='seconds between samples')
+    parser.add_argument('--timeout', type=float, default=600, help='seconds after which a request counts as failed')
+    parser.add_argument('--seed', type=int, default=1)
+    arguments = parser.parse_args()
+    if settings.worker_processes > 0:
+        parser.error('the DSLite servers live in the embedded R, run with FDRTD_DATASHIELD_WORKER_PROCESSES=0')
+    if '=' in arguments.latency:
+        latencies = dict((name, float(value)) for name, value in
+                         (item.split('=') for item in arguments.latency.split(',')))
+    else:
+        latencies = dict((f'study{index + 1}', float(arguments.latency)) for index in range(arguments.studies))
+    servers = start_servers(arguments.studies, arguments.rows, latencies, arguments.seed)
+    login = Login(LocalBus(), 'login')
+    recorder = Recorder()
+    samples = []
+    stop = threading.Event()
+    started = time.monotonic()
+    threads = [threading.Thread(target=client, args=(login, servers, arguments, recorder, stop, arguments.seed + index),
+                                daemon=True) for index in range(arguments.clients)]
+    threads.append(threading.Thread(target=sample, args=(recorder, started, arguments.interval, samples, stop),
+                                    daemon=True))
+    for thread in threads:
+        thread.start()
+    time.sleep(arguments.duration)
+    stop.set()
+    for thread in threads:
+        thread.join()
+    elapsed = time.monotonic() - started
+    events = recorder.since(started)
+    report = {
+        'timestamp': time.time(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'R': str(runtime.robjects().r('R.version.string')[0]),
+        'parameters': vars(arguments),
+        'settings': dict((key, getattr(settings, key)) for key in ('executor_queue_size', 'connection_concurrency',
+                                                                   'connection_max_calls', 'session_pool_size')),
+        'summary': dict([('all', summary(events, elapsed))] + [
+            (kind, summary([event for event in events if event['kind'] == kind], elapsed))
+            for kind in ('login', 'aggregate', 'assign', 'plot', 'logout')
+        ]),
+        'samples': samples
+    }
+    if arguments.output is None:
+        json.dump(report, sys.stdout, indent=2)
+    else:
+        with open(arguments.output, 'w') as file:
+            json.dump(report, file, indent=2)
+
+
+if __name__ == '__main__':
+    main()
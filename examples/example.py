@@ -28,21 +28,34 @@ list_of_servers = [
 ]
 
 login_callback = login.login(list_of_servers=list_of_servers, assign=True, symbol='D')
+# By default the login fails if any of the servers cannot be reached. With partial=True every server
+# is logged in to on its own, with a time limit of server_timeout seconds (servers that cannot be
+# reached at all are found by probing all of them in parallel first), and the connection is made
+# of the servers that succeeded; the "servers" list of the login status shows the latency or error
+# of each of them. With retry_failed=True the failed servers are retried in the background and added
+# to the connection once they answer:
+# login.login(list_of_servers=list_of_servers, assign=True, symbol='D', partial=True, server_timeout=20,
+#             retry_failed=True)
+# With catalog=True (together with assign=True) the login also fetches ds.ls() and ds.class, ds.colnames,
+# ds.dim and ds.length of the assigned symbol in the same pass. Those calls are then answered from the
+# catalog without contacting the servers. After an assigning call overwrites the symbol, the next
+# lookup of it goes to the servers and refreshes the catalog in the background; pass use_catalog=False
+# to a call to bypass it:
+# login.login(list_of_servers=list_of_servers, assign=True, symbol='D', catalog=True)
 # with protocol_DataSHIELD, you can print the progress of any function live, just like it is visible
 # in R when a function is called, a function_callback is returned to the client while the function
 # keeps running on the server in a separate thread. While it is running, you can use the
 # following "result" function to get the live progress bar it will also return the end result of
-# the function call.
+# the function call. Passing a cursor to get_status only returns the output written since the last
+# status, and with a timeout the server holds the request (up to 30 seconds) until there is new
+# output or the function has finished, so the client does not need to poll in a tight loop.
 
 def result(function_callback):
-    status_old = api.download(function_callback.get_status())
-    print(''.join(status_old['warnerror']), end='')
-    while status_old['busy']:
-        status_new = api.download(function_callback.get_status())
-        if len(status_new['warnerror']) != len(status_old['warnerror']):
-            print(''.join(status_new['warnerror'][len(status_old['warnerror']):]), end='')
-        status_old = status_new
-    print(''.join(status_old['print']))
+    status = {'busy': True, 'cursor': {}}
+    while status['busy']:
+        status = api.download(function_callback.get_status(cursor=status['cursor'], timeout=10))
+        print(''.join(status['warnerror']), end='')
+        print(''.join(status['print']), end='')
     return api.download(function_callback.get_result())
 
 connection_callback = result(login_callback)
@@ -72,9 +85,97 @@ connection_callback = result(login_callback)
 # connection_callback.matrixDet_report(parameters) (instead of matrixDet.report)
 # connection_callback.dataFrame(parameters, row_names) (instead of row.names)
 
+# Results are returned as nested lists and dictionaries by default. For large matrices and
+# data.frames, pass result_format='columnar' to get typed column buffers instead: every numeric
+# column comes with its "dtype", base64-encoded "data" and, if it contains NAs, a "validity" bitmap.
+# They can be decoded without any parsing, e. g.:
+# import base64, numpy as np
+# column = result(connection_callback.dim(x='D', result_format='columnar'))['value'][0]
+# values = np.frombuffer(base64.b64decode(column['data']), dtype=column['dtype'])
+# valid = np.unpackbits(np.frombuffer(base64.b64decode(column['validity']), dtype=np.uint8),
+#                       count=column['length'], bitorder='little').astype(bool)
+
 # Full example:
 quantileMean_result = result(connection_callback.quantileMean(x='D$LAB_HDL'))
 print(quantileMean_result)
 
+# A large result can be fetched in pages: get_result(offset=..., limit=...) returns the list elements
+# (or, for a dictionary, the top-level keys) from offset to offset + limit together with the total
+# count, and get_result_metadata() returns the type, length, keys, shape, column names and size in
+# bytes of the result without the result itself:
+# summary_callback = connection_callback.summary(x='D')
+# result(summary_callback)
+# print(api.download(summary_callback.get_result_metadata()))
+# page = api.download(summary_callback.get_result(offset=0, limit=100))
+
+# Plot functions (ds.histogram, ds.scatterPlot, ...) keep the plot on the server and return its
+# "plot_uuid". get_plot renders it in the requested format ('png', 'svg' or 'pdf') and size in
+# inches and returns the base64-encoded file; preview=True gives a cheap low-resolution version:
+# import base64
+# histogram_callback = connection_callback.histogram(x='D$LAB_HDL')
+# result(histogram_callback)
+# plot = api.download(histogram_callback.get_plot(plot_format='png', width=8, height=6, res=150))
+# open('histogram.png', 'wb').write(base64.b64decode(plot['data']))
+
+# With stream_servers=True the function still runs once on all servers, whose requests are sent in
+# parallel, but every study's answer to each server-side request ("round") is appended to the "servers"
+# list of the status (with its latency in seconds) as soon as it arrives, so a slow study is visible
+# right away. The result of the function, split or combined, follows at the end:
+# result(connection_callback.mean(x='D$LAB_HDL', type='combine', stream_servers=True))
+# -> {'servers': [{'server': 'study1', 'round': 1, 'result': ..., 'latency': 0.4}, ...], 'result': ...}
+
+# Several calls can be sent as one batch, which runs them back to back on the server in a single
+# request. The result is a list with one entry per step, and the status lists the steps finished so
+# far. By default the batch stops at the first failing step; pass stop_on_error=False to continue.
+batch_result = result(connection_callback.call_batch(steps=[
+    {'func': 'ds.assign', 'parameters': {'toAssign': 'D$LAB_HDL', 'newobj': 'hdl'}},
+    {'func': 'ds.mean', 'parameters': {'x': 'hdl'}},
+    {'func': 'ds.quantileMean', 'parameters': {'x': 'hdl'}}
+]))
+print(batch_result)
+
+# With set_lazy() (or lazy=True on a single call) the assigning functions ds.assign, ds.c, ds.exp,
+# ds.log, ds.abs, ds.sqrt and ds.replaceNA are not run right away. They are recorded and run just before
+# the first function that reads their result, so an object that is overwritten before it is read is
+# never computed. Chains such as exp, log, abs and sqrt are merged into a single ds.assign expression.
+# Errors of a deferred function are reported by the call that reads its result, and the connection
+# status lists the pending objects under "deferred":
+# api.download(connection_callback.set_lazy(lazy=True))
+# connection_callback.exp(x='D$LAB_HDL', newobj='hdl_exp')
+# connection_callback.log(x='hdl_exp', newobj='hdl_log')
+# result(connection_callback.mean(x='hdl_log'))  # one ds.assign of log(exp(D$LAB_HDL)), then ds.mean
+
+# A running call can be stopped with cancel(); R is interrupted and the call finishes with the
+# error "cancelled". Passing deadline=<seconds> to a call (or to call_batch) does the same
+# automatically once the deadline has passed:
+# glm_callback = connection_callback.glm(formula='D$LAB_HDL~D$GENDER', family='gaussian', deadline=600)
+# api.download(glm_callback.cancel())
+
+# Calls of all connections share the R interpreter and are handed to it by a fair scheduler, so a
+# connection sending many calls does not hold up the others. Single calls are 'interactive' by default
+# and batches are 'batch', which get a smaller share of R time; pass priority='batch' to a long
+# series of calls. While a call waits, its status has a "queue" entry with its position and the
+# seconds it has waited so far, and the connection status shows the number of calls "in_flight":
+# connection_callback.assign(toAssign='D$LAB_HDL', newobj='hdl', priority='batch')
+
+# Every status carries "timings": when the call was queued, started and finished, and the seconds
+# spent waiting for R ("queue"), in R ("r"), converting the result ("conversion") and in total.
+# Aggregated counters and latency histograms per function are available in the Prometheus text
+# format, e. g. for a scrape job: print(api.download(connection_callback.get_metrics()))
+
+# All R objects of a login (the login builder, the server connections and the recorded plots) live in
+# one R environment per session, which is removed on logout, when a login fails and when an idle pooled
+# session is evicted. get_status(memory=True) on the connection callback reports the bytes held by the
+# session and the size of the whole R heap:
+# print(api.download(connection_callback.get_status(memory=True))['memory'])
+
+# If the server runs with FDRTD_DATASHIELD_SNAPSHOT_PATH set, the server-side workspaces of the open
+# connections are saved when it shuts down. After the restart the same connection_callback keeps
+# working: its first use logs in again with restore=<workspace>, so all server-side objects are back
+# without replaying the calls that created them. The status of finished calls is kept, but their
+# results are not; the connection status shows "restored": True. Passwords and tokens are not saved,
+# so a connection that logged in with them has to get them back once before its first use:
+# api.download(connection_callback.restore_connection(list_of_servers=list_of_servers))
+
 # To logout from the DataSHIELD servers:
 logout_result = result(connection_callback.logout())
@@ -14,7 +14,8 @@ def get_microservices():
             "public": [
                 "login",
                 "get_status",
-                "get_result"
+                "get_result",
+                "get_metrics"
             ]
             #},
             #{
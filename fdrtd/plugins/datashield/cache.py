@@ -0,0 +1,75 @@
+import json
+import time
+from collections import OrderedDict
+from threading import Lock
+
+
+class ResultCache:
+
+    def __init__(self, max_entries, ttl):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.generations = {}
+        self.counters = {}
+        self.evictions = 0
+        self.lock = Lock()
+
+    @staticmethod
+    def key(connection, func, parameters):
+        return connection, func, json.dumps(parameters, sort_keys=True, default=str)
+
+    def connection_counters(self, connection):
+        return self.counters.setdefault(connection, {'hits': 0, 'misses': 0, 'invalidations': 0})
+
+    def generation(self, connection):
+        return self.generations.get(connection, 0)
+
+    def get(self, key):
+        with self.lock:
+            counters = self.connection_counters(key[0])
+            entry = self.entries.get(key)
+            if entry is not None and entry[0] < time.monotonic():
+                del self.entries[key]
+                entry = None
+            if entry is None:
+                counters['misses'] += 1
+                return False, None
+            self.entries.move_to_end(key)
+            counters['hits'] += 1
+            return True, entry[1]
+
+    def put(self, key, generation, value):
+        with self.lock:
+            if self.max_entries <= 0 or generation != self.generation(key[0]) or key[0] not in self.counters:
+                return None
+            self.entries[key] = (time.monotonic() + self.ttl, value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+        return None
+
+    def invalidate(self, connection):
+        with self.lock:
+            self.generations[connection] = self.generation(connection) + 1
+            for key in [key for key in self.entries if key[0] == connection]:
+                del self.entries[key]
+            self.connection_counters(connection)['invalidations'] += 1
+
+    def forget(self, connection):
+        with self.lock:
+            for key in [key for key in self.entries if key[0] == connection]:
+                del self.entries[key]
+            self.generations.pop(connection, None)
+            self.counters.pop(connection, None)
+
+    def get_status(self, connection):
+        with self.lock:
+            return {
+                **self.counters.get(connection, {'hits': 0, 'misses': 0, 'invalidations': 0}),
+                'entries': sum(1 for key in self.entries if key[0] == connection),
+                'total_entries': len(self.entries),
+                'max_entries': self.max_entries,
+                'evictions': self.evictions
+            }
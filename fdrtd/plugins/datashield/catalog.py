@@ -0,0 +1,84 @@
+from fdrtd.plugins.datashield import helpers
+from fdrtd.plugins.datashield.deferred import symbols
+
+
+class Catalog:
+
+    def __init__(self, fetched=None):
+        self.enabled = fetched is not None
+        self.symbols = set() if fetched is None else set(fetched['symbols'])
+        self.entries = {}
+        self.stale = set()
+        self.listing_stale = False
+        self.generation = 0
+        self.refreshing = False
+        self.hits = 0
+        if fetched is not None:
+            self.update(fetched, 0)
+
+    def update(self, fetched, generation):
+        self.refreshing = False
+        if generation != self.generation:
+            return False
+        if 'ds.ls' in fetched:
+            self.entries[('ds.ls', None)] = fetched['ds.ls']
+            self.listing_stale = False
+        for name, results in fetched['symbols'].items():
+            self.entries.update(((func, name), result) for func, result in results.items())
+            self.stale.discard(name)
+        return True
+
+    @staticmethod
+    def key(func, matched):
+        if func == 'ds.ls' and not matched:
+            return 'ds.ls', None
+        if func in helpers.catalog_functions and set(matched) == {'x'}:
+            return func, matched['x']
+        return None
+
+    def lookup(self, func, matched, parameters):
+        if not self.enabled or any(key in parameters for key in helpers.result_options):
+            return False, None
+        key = self.key(func, matched)
+        if key is None or key not in self.entries:
+            return False, None
+        self.hits += 1
+        return True, self.entries[key]
+
+    def missing(self, func, matched):
+        key = self.key(func, matched) if self.enabled else None
+        if key is None:
+            return None
+        if key[1] is None:
+            return (self.stale, True) if self.listing_stale else None
+        return (self.stale, False) if key[1] in self.stale else None
+
+    def invalidate(self, matched):
+        if not self.enabled:
+            return None
+        touched = self.symbols & symbols(matched.get('newobj', matched))
+        self.generation += 1
+        self.listing_stale = True
+        self.entries.pop(('ds.ls', None), None)
+        for key in [key for key in self.entries if key[1] in touched]:
+            del self.entries[key]
+        self.stale |= touched
+        return None
+
+    def expire(self):
+        if not self.enabled:
+            return None
+        self.generation += 1
+        self.entries.clear()
+        self.stale = set(self.symbols)
+        self.listing_stale = True
+        return None
+
+    def fail(self):
+        self.refreshing = False
+        self.stale.clear()
+        self.listing_stale = False
+
+    def get_status(self):
+        return {'enabled': self.enabled, 'symbols': sorted(self.symbols), 'entries': len(self.entries),
+                'stale': sorted(self.stale), 'hits': self.hits}
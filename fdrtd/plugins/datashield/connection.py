@@ -1,32 +1,25 @@
+import base64
 import functools
+import logging
+import time
 import uuid as _uuid
-from threading import Thread
-import importlib.util
-from pathlib import Path
-
-import rpy2
-import rpy2.rinterface
-import rpy2.rinterface_lib
-from rpy2.robjects.packages import importr
+from concurrent.futures import Future, wait
+from threading import Lock, RLock
 
 import fdrtd.server
 from fdrtd.server.microservice import Microservice
-try:
-    from fdrtd.plugins.protocol_DataSHIELD.src import helpers
-except ImportError:
-    spec_helpers = importlib.util.spec_from_file_location('helpers', Path(__file__).resolve().parent / 'helpers.py')
-    helpers = importlib.util.module_from_spec(spec_helpers)
-    spec_helpers.loader.exec_module(helpers)
-
-consolewrite_warnerror_backup = rpy2.rinterface_lib.callbacks.consolewrite_warnerror
-consolewrite_print_backup = rpy2.rinterface_lib.callbacks.consolewrite_print
-
-base = importr('base')
-DSI = importr('DSI')
-DSOpal = importr('DSOpal')
-dsBaseClient = importr('dsBaseClient')
-grDevices = importr('grDevices')
-jsonlite_R = importr('jsonlite')
+from fdrtd.plugins.datashield import helpers, runtime, settings
+from fdrtd.plugins.datashield.cache import ResultCache
+from fdrtd.plugins.datashield.catalog import Catalog
+from fdrtd.plugins.datashield.deferred import AssignmentGraph
+from fdrtd.plugins.datashield.executor import get_deadlines, get_executor
+from fdrtd.plugins.datashield.metrics import Metrics
+from fdrtd.plugins.datashield.scheduler import get_scheduler
+from fdrtd.plugins.datashield.sessions import get_session_pool, session_symbol
+from fdrtd.plugins.datashield.snapshots import add_credentials, credential_servers, load_manifest, \
+    missing_credentials, on_shutdown, strip_credentials, workspace_name, write_manifest
+from fdrtd.plugins.datashield.status import StatusBoard
+from fdrtd.plugins.datashield.store import ResultStore
 
 
 class Connection(Microservice):
@@ -37,179 +30,674 @@ class Connection(Microservice):
 
         self.connections = {}
         self.storage = {}
-        self.function_results_storage = {}
+        self.futures = {}
+        self.graphs = {}
+        self.catalogs = {}
+        self.snapshots = load_manifest(settings.snapshot_path, settings.snapshot_ttl)
+        self.restoring = {}
+        self.snapshot_lock = RLock()
+        self.shut_down = False
+        if settings.snapshot_path:
+            on_shutdown(self.shutdown)
+        self.function_results_storage = ResultStore(
+            settings.result_store_memory, settings.result_store_ttl, settings.result_store_spill_threshold,
+            settings.result_store_spill_path, settings.result_store_chunk_items
+        )
+        self.status_board = StatusBoard()
+        self.metrics = Metrics('datashield')
+        self.result_cache = ResultCache(settings.result_cache_size, settings.result_cache_ttl)
+        self.plot_cache = ResultCache(settings.plot_cache_size, settings.plot_cache_ttl)
+        self.plans = None
+        self.plans_lock = Lock()
         self.deprecated = {
             'ds.listOpals', 'ds.listServersideFunctions', 'ds.look', 'ds.meanByClass', 'ds.message', 'ds.recodeLevels',
             'ds.setDefaultOpals', 'ds.subset', 'ds.subsetByClass', 'ds.table1D', 'ds.table2D', 'ds.vectorCalc'
         }
         self.return_types = {
-            'return': set(base.ls('package:dsBaseClient')) - {
+            'no_return': {
                 'ds.exp', 'ds.assign', 'ds.c', 'ds.recodeLevels', 'ds.changeRefGroup', 'ds.list', 'ds.log',
                 'ds.vectorCalc', 'ds.subset', 'ds.sqrt', 'ds.replaceNA', 'ds.abs', 'ds.subsetByClass', 'ds.heatmapPlot',
                 'ds.contourPlot'
             },
             'plot': {
                 'ds.histogram', 'ds.boxPlot', 'ds.contourPlot', 'ds.heatmapPlot', 'ds.scatterPlot'
+            },
+            'aggregate': {
+                'ds.class', 'ds.colnames', 'ds.cor', 'ds.corTest', 'ds.cov', 'ds.dim', 'ds.exists', 'ds.glm',
+                'ds.isNA', 'ds.isValid', 'ds.kurtosis', 'ds.length', 'ds.levels', 'ds.ls', 'ds.mean', 'ds.meanSdGp',
+                'ds.names', 'ds.numNA', 'ds.quantileMean', 'ds.skewness', 'ds.summary', 'ds.table', 'ds.tapply',
+                'ds.var'
             }
         }
+        self.assigning_parameters = {'newobj', 'table.assign', 'save.mean.Nstudies'}
         self.input_type_requirements = {
             'x_vec': ['ds.vectorCalc']
         }
 
+    def get_plans(self):
+        with self.plans_lock:
+            if self.plans is None:
+                formals = get_executor().submit('list_formals').result()
+                self.plans = dict((func, {
+                    'aliases': helpers.parameter_aliases(func_formals),
+                    'returns': func not in self.return_types['no_return'],
+                    'plot': func in self.return_types['plot'],
+                    'aggregate': func in self.return_types['aggregate'],
+                    'deprecated': func in self.deprecated
+                }) for func, func_formals in formals.items())
+            return self.plans
+
     def make_public(self):
         functions_dict = {}
-        funcnames = list(base.ls('package:dsBaseClient'))
-        for func in funcnames:
+        exports = runtime.exports('dsBaseClient')
+        for func in self.get_plans() if exports is None else exports:
             functions_dict[func[3:].replace('.', '_')] = functools.partial(self.call_function, func=func)
         return functions_dict
 
     def connect(self, connection, uuid):
+        for old_uuid in [old_uuid for old_uuid in self.storage if old_uuid not in self.connections]:
+            calls = self.storage[old_uuid]['calls']
+            self.status_board.prune(calls, len(calls), settings.status_ttl)
+            if not calls:
+                del self.storage[old_uuid]
+                self.graphs.pop(old_uuid, None)
+                self.catalogs.pop(old_uuid, None)
+                self.forget_caches(old_uuid)
         self.connections[uuid] = connection
+        self.graphs[uuid] = AssignmentGraph()
+        self.catalogs[uuid] = Catalog(connection.pop('catalog', None))
         self.storage[uuid] = {
             'warnerror': [],
             'print': [],
             'busy': False,
-            'path_to_temp_plot_storage': '',
+            'in_flight': 0,
+            'dirty': False,
+            'lazy': False,
             'calls': {}
         }
-        self.function_results_storage[uuid] = {}
-        rpy2.rinterface_lib.callbacks.consolewrite_warnerror = lambda e: self.storage[uuid]['warnerror'].append(e)
-        rpy2.rinterface_lib.callbacks.consolewrite_print = lambda e: self.storage[uuid]['print'].append(e)
         return self.callback({'connection': uuid})
 
+    def set_lazy(self, callback: dict, lazy: bool = True):
+        connection_uuid = callback['connection']
+        self.require(connection_uuid)
+        self.storage[connection_uuid]['lazy'] = bool(lazy)
+        return None
+
+    def require(self, connection_uuid):
+        with self.snapshot_lock:
+            if connection_uuid not in self.connections and connection_uuid in self.snapshots:
+                entry = self.snapshots[connection_uuid]
+                if entry.get('credentials'):
+                    raise fdrtd.server.exceptions.ApiError(
+                        401, f'connection {connection_uuid} was saved without the credentials of '
+                             f'{", ".join(entry["credentials"])}, pass them to restore_connection'
+                    )
+                self.restoring[connection_uuid] = self.restore(connection_uuid, self.snapshots.pop(connection_uuid),
+                                                               entry['servers'])
+            restoring = self.restoring.get(connection_uuid)
+        if restoring is not None:
+            try:
+                restoring.result()
+            except Exception as err:
+                raise fdrtd.server.exceptions.InternalServerError(
+                    f'restoring connection {connection_uuid} failed: {err}'
+                )
+        if connection_uuid not in self.connections:
+            raise fdrtd.server.exceptions.MissingParameter(f'connection {connection_uuid}')
+
+    def restore_connection(self, callback: dict, list_of_servers: list):
+        connection_uuid = callback['connection']
+        with self.snapshot_lock:
+            entry = self.snapshots.get(connection_uuid)
+            if entry is not None:
+                missing = missing_credentials(entry, list_of_servers)
+                if missing:
+                    raise fdrtd.server.exceptions.InvalidParameter('list_of_servers',
+                                                                   f'no credentials for {", ".join(missing)}')
+                self.restoring[connection_uuid] = self.restore(connection_uuid, self.snapshots.pop(connection_uuid),
+                                                               add_credentials(entry['servers'], list_of_servers))
+        self.require(connection_uuid)
+        return self.callback(callback)
+
+    def restore(self, connection_uuid, entry, servers):
+        restored = Future()
+        session = str(_uuid.uuid4())
+        parameters = dict(entry['parameters'], restore=entry['workspace'], assign=False)
+        if parameters.get('partial', False):
+            job_args = ('login_servers', session, servers, parameters,
+                        parameters.get('server_timeout', settings.login_server_timeout))
+        else:
+            job_args = ('login', session, servers, parameters)
+        try:
+            future = get_executor().submit(*job_args, pin=session)
+        except fdrtd.server.exceptions.ApiError as err:
+            self.snapshots[connection_uuid] = entry
+            self.restoring.pop(connection_uuid, None)
+            restored.set_exception(err)
+            return restored
+        future.add_done_callback(functools.partial(self.restore_helper, connection_uuid, entry, servers, session,
+                                                   restored))
+        return restored
+
+    def restore_helper(self, connection_uuid, entry, servers, session, restored, future):
+        try:
+            future.result()
+        except Exception as err:
+            get_executor().release(session)
+            with self.snapshot_lock:
+                self.restoring.pop(connection_uuid, None)
+                self.snapshots[connection_uuid] = entry
+            restored.set_exception(err)
+            return None
+        self.connect({'session': session, 'symbol': session_symbol(session), 'pooled': False,
+                      'login': {'servers': servers, 'parameters': entry['parameters']}}, connection_uuid)
+        self.storage[connection_uuid]['calls'].update(entry['calls'])
+        self.storage[connection_uuid].update({'lazy': entry['lazy'], 'restored': True})
+        with self.snapshot_lock:
+            self.restoring.pop(connection_uuid, None)
+        try:
+            get_scheduler().submit(connection_uuid, 'batch', 'remove_workspace', session_symbol(session),
+                                   entry['workspace'], pin=session)
+        except fdrtd.server.exceptions.ApiError:
+            pass
+        restored.set_result(connection_uuid)
+        return None
+
+    def shutdown(self):
+        with self.snapshot_lock:
+            if self.shut_down:
+                return None
+            self.shut_down = True
+        return self.snapshot()
+
+    def snapshot(self):
+        saving = []
+        for connection_uuid, connection in list(self.connections.items()):
+            if 'login' not in connection:
+                continue
+            graph = self.graphs[connection_uuid]
+            sent = graph.send(graph.materialize())
+            progress = {'materialized': [], 'warnerror': [], 'print': [], 'timings': {}}
+            workspace = workspace_name(connection_uuid)
+            job, args = 'save_workspace', (connection['symbol'], workspace)
+            if sent:
+                job, args = 'after_steps', (connection['symbol'], graph.steps(sent), job, workspace)
+            try:
+                future = get_scheduler().submit(connection_uuid, 'interactive', job, *args,
+                                                console=self.status_board.console(progress), pin=connection['session'])
+            except fdrtd.server.exceptions.ApiError as err:
+                graph.forget(sent, 0)
+                logging.error(f'could not save the workspace of connection {connection_uuid}: {err}')
+                continue
+            future.add_done_callback(functools.partial(self.forget_sent, graph, sent, progress['materialized']))
+            saving.append((connection_uuid, connection, workspace, future))
+        entries = {}
+        wait([future for _, _, _, future in saving], timeout=settings.snapshot_timeout)
+        for connection_uuid, connection, workspace, future in saving:
+            if not future.done():
+                logging.error(f'could not save the workspace of connection {connection_uuid} within '
+                              f'{settings.snapshot_timeout} seconds')
+                continue
+            try:
+                future.result()
+            except Exception as err:
+                logging.error(f'could not save the workspace of connection {connection_uuid}: {err}')
+                continue
+            calls = self.storage[connection_uuid]['calls']
+            entries[connection_uuid] = {
+                'workspace': workspace,
+                'servers': strip_credentials(connection['login']['servers']),
+                'credentials': credential_servers(connection['login']['servers']),
+                'parameters': connection['login']['parameters'],
+                'lazy': self.storage[connection_uuid]['lazy'],
+                'calls': dict((call_uuid, call) for call_uuid, call in list(calls.items()) if not call['busy']),
+                'saved': time.time()
+            }
+        logging.info(f'saved the workspaces of {len(entries)} DataSHIELD connections to {settings.snapshot_path}')
+        with self.snapshot_lock:
+            entries.update(self.snapshots)
+        write_manifest(settings.snapshot_path, entries)
+        return None
+
+    def connected(self, uuid):
+        return uuid in self.connections
+
+    def refresh(self, uuid):
+        self.result_cache.invalidate(uuid)
+        self.catalogs[uuid].expire()
+        return None
+
     def call_function(self, callback: dict, func: str, parameters: dict = None, **kwargs):
         connection_uuid = callback['connection']
+        self.require(connection_uuid)
         if parameters is None:
             parameters = {}
         parameters.update(kwargs)
+        step = self.prepare_step(connection_uuid, func, parameters)
+        if parameters.get('stream_servers', False):
+            return self.call_function_per_server(callback, func, parameters, step)
+        call = self.new_call(callback, func)
+        if parameters.get('use_catalog', True):
+            hit, result = self.catalogs[connection_uuid].lookup(func, step['matched'], parameters)
+            if hit:
+                call['catalog'] = True
+                self.function_results_storage.put((connection_uuid, callback['call']), result)
+                self.finish(connection_uuid, call)
+                return self.callback(callback)
+            self.refresh_catalog(connection_uuid, func, step['matched'])
+        if parameters.get('lazy', self.storage[connection_uuid]['lazy']) and step['plot_uuid'] is None \
+                and self.graphs[connection_uuid].defer(func, step['matched'], parameters):
+            call['deferred'] = True
+            self.function_results_storage.put((connection_uuid, callback['call']), None)
+            self.finish(connection_uuid, call)
+            return self.callback(callback)
+        pending = self.pending_steps(connection_uuid, func, step)
+        cache_key = None
+        cache_generation = self.result_cache.generation(connection_uuid)
+        if self.result_cache.max_entries > 0 and step['read_only'] and parameters.get('use_cache', True) \
+                and not pending:
+            matched = dict(step['matched'])
+            matched.update((key, parameters[key]) for key in helpers.result_options if key in parameters)
+            cache_key = self.result_cache.key(connection_uuid, func, matched)
+            hit, result = self.result_cache.get(cache_key)
+            if hit:
+                call['cached'] = True
+                self.function_results_storage.put((connection_uuid, callback['call']), result)
+                self.finish(connection_uuid, call)
+                return self.callback(callback)
+        helper = functools.partial(self.call_function_helper, callback, step, cache_key, cache_generation)
+        self.submit_call(callback, helper, pending, 'call_function', func, parameters, step['plot_uuid'],
+                         step['returns'], deadline=parameters.get('deadline', settings.call_timeout),
+                         priority=parameters.get('priority', 'interactive'))
+        return self.callback(callback)
+
+    def call_function_per_server(self, callback: dict, func: str, parameters: dict, step):
+        if step['plot_uuid'] is not None:
+            raise fdrtd.server.exceptions.InvalidParameter('stream_servers', f'not supported for {func}')
+        pending = self.pending_steps(callback['connection'], func, step)
+        call = self.new_call(callback, func)
+        call['servers'] = []
+        helper = functools.partial(self.call_function_helper, callback, step, None, None)
+        self.submit_call(callback, helper, pending, 'call_function_per_server', func, parameters, step['returns'],
+                         deadline=parameters.get('deadline', settings.call_timeout),
+                         priority=parameters.get('priority', 'interactive'))
+        return self.callback(callback)
+
+    def call_batch(self, callback: dict, steps: list, stop_on_error: bool = True, deadline: float = None,
+                   priority: str = 'batch'):
+        connection_uuid = callback['connection']
+        self.require(connection_uuid)
+        prepared_steps = []
+        job_steps = []
+        for step in steps:
+            if 'func' not in step:
+                raise fdrtd.server.exceptions.MissingParameter('func')
+            parameters = step.get('parameters') or {}
+            prepared_step = self.prepare_step(connection_uuid, step['func'], parameters)
+            prepared_steps.append(prepared_step)
+            job_steps.append({'func': step['func'], 'parameters': parameters,
+                              'plot_uuid': prepared_step['plot_uuid'], 'returns': prepared_step['returns']})
+        pending = self.graphs[connection_uuid].materialize()
+        call = self.new_call(callback, 'batch')
+        call['steps'] = []
+        self.submit_call(callback, functools.partial(self.call_batch_helper, callback, prepared_steps), pending,
+                         'call_batch', job_steps, stop_on_error,
+                         deadline=settings.call_timeout if deadline is None else deadline, priority=priority)
+        return self.callback(callback)
+
+    def prepare_step(self, connection_uuid, func, parameters):
+        if parameters.get('result_format', 'json') not in helpers.result_formats:
+            raise fdrtd.server.exceptions.InvalidParameter('result_format', parameters['result_format'])
+        plan = self.get_plans().get(func)
+        if plan is None:
+            raise fdrtd.server.exceptions.FunctionNotFound(f'{func} not in dsBaseClient')
+        matched = helpers.match_aliases(plan['aliases'], parameters)
+        step = {
+            'returns': plan['returns'],
+            'matched': matched,
+            'read_only': self.read_only(plan, matched),
+            'plot_uuid': None
+        }
+        if not step['read_only']:
+            self.storage[connection_uuid]['dirty'] = True
+            self.result_cache.invalidate(connection_uuid)
+            self.catalogs[connection_uuid].invalidate(matched)
+        if plan['plot']:
+            step['plot_uuid'] = str(_uuid.uuid4()).replace('-', '')
+        return step
+
+    def pending_steps(self, connection_uuid, func, step):
+        if step['read_only'] and func != 'ds.ls':
+            return self.graphs[connection_uuid].read(step['matched'])
+        return self.graphs[connection_uuid].materialize()
+
+    def submit_call(self, callback: dict, helper, pending, job: str, *args, deadline=None, priority='interactive'):
+        graph = self.graphs[callback['connection']]
+        symbol = self.connections[callback['connection']]['symbol']
+        sent = graph.send(pending)
+        if sent:
+            call = self.storage[callback['connection']]['calls'][callback['call']]
+            call['materialized'] = []
+            job, args = 'after_steps', (symbol, graph.steps(sent), job) + args
+            helper = functools.partial(self.materialize_helper, graph, sent, call['materialized'], helper)
+        else:
+            args = (symbol,) + args
+        try:
+            self.submit_helper(callback, helper, job, *args, deadline=deadline, priority=priority)
+        except fdrtd.server.exceptions.ApiError:
+            graph.forget(sent, 0)
+            raise
+
+    @staticmethod
+    def forget_sent(graph, sent, materialized, future):
+        if future.cancelled() or future.exception() is not None:
+            graph.forget(sent, len(materialized))
+        else:
+            graph.forget(sent, len(sent))
+
+    def materialize_helper(self, graph, sent, materialized, helper, future):
+        self.forget_sent(graph, sent, materialized, future)
+        helper(future)
+
+    def new_call(self, callback: dict, func: str):
+        connection_uuid = callback['connection']
+        calls = self.storage[connection_uuid]['calls']
+        if sum(1 for call in calls.values() if call['busy']) >= settings.connection_max_calls:
+            raise fdrtd.server.exceptions.ApiError(
+                503, f'overloaded: {settings.connection_max_calls} calls already in flight on this connection'
+            )
         call_uuid = str(_uuid.uuid4())
         callback.update({'call': call_uuid})
-        self.storage[connection_uuid]['busy'] = True
-        self.storage[connection_uuid]['calls'][call_uuid] = {
+        self.status_board.prune(calls, settings.status_records, settings.status_ttl)
+        call = {
             'function': func,
             'warnerror': [],
             'print': [],
-            'busy': True
+            'busy': True,
+            'timings': {'queued': time.time()}
         }
-        Thread(target=self.call_function_helper, args=(callback, func, parameters), daemon=True).start()
+        calls[call_uuid] = call
+        self.update_busy(connection_uuid)
+        return call
+
+    def update_busy(self, connection_uuid):
+        in_flight = sum(1 for call in self.storage[connection_uuid]['calls'].values() if call['busy'])
+        self.storage[connection_uuid].update({'busy': in_flight > 0, 'in_flight': in_flight})
+
+    def read_only(self, plan, matched):
+        return plan['aggregate'] and not any(
+            matched.get(key) for key in self.assigning_parameters
+        )
+
+    def submit_helper(self, callback: dict, helper, job: str, *args, deadline=None, priority='interactive'):
+        connection_uuid = callback['connection']
+        call = self.storage[connection_uuid]['calls'][callback['call']]
+        try:
+            future = get_scheduler().submit(connection_uuid, priority, job, *args,
+                                            console=self.status_board.console(call),
+                                            pin=self.connections[connection_uuid]['session'])
+        except fdrtd.server.exceptions.ApiError:
+            del self.storage[connection_uuid]['calls'][callback['call']]
+            self.update_busy(connection_uuid)
+            raise
+        key = (connection_uuid, callback['call'])
+        self.futures[key] = future
+        future.add_done_callback(lambda _: self.futures.pop(key, None))
+        future.add_done_callback(helper)
+        if deadline:
+            get_deadlines().add(float(deadline), functools.partial(
+                get_scheduler().cancel, future, f'deadline of {deadline} seconds exceeded'
+            ))
+
+    def cancel(self, callback: dict):
+        connection_uuid = callback.get('connection')
+        call_uuid = callback.get('call')
+        future = self.futures.get((connection_uuid, call_uuid))
+        if future is None:
+            raise fdrtd.server.exceptions.InvalidParameter(f'call {call_uuid}', 'not running')
+        self.storage[connection_uuid]['calls'][call_uuid]['cancelled'] = True
+        get_scheduler().cancel(future, 'cancelled')
         return self.callback(callback)
 
-    def call_function_helper(self, callback: dict, func: str, parameters: dict):
-        func_ = func.replace('.', '_')
+    @staticmethod
+    def step_result(step, result):
+        if step['plot_uuid'] is None:
+            return result
+        return_dict = {'plot_uuid': step['plot_uuid']}
+        if step['returns']:
+            return_dict['return_json'] = result
+        return return_dict
+
+    def call_function_helper(self, callback: dict, step, cache_key, cache_generation, future):
         connection_uuid = callback['connection']
         call_uuid = callback['call']
-        connection = self.connections[connection_uuid]
         call = self.storage[connection_uuid]['calls'][call_uuid]
-        if 'servers' in parameters:
-            connection = helpers.extract_connections(connection, parameters['servers'])
-        return_serial_json = parameters.get('return_serial_JSON', False)
-        rpy2.rinterface_lib.callbacks.consolewrite_warnerror = lambda e: call['warnerror'].append(e)
-        rpy2.rinterface_lib.callbacks.consolewrite_print = lambda e: call['print'].append(e)
-        parameters_used = helpers.defaults(getattr(dsBaseClient, func_), parameters)
-        if 'datasources' in parameters_used:
-            parameters_used['datasources'] = connection
-        if func_ not in dir(dsBaseClient):
-            self.storage[connection_uuid]['busy'] = False
-            call['busy'] = False
-            raise fdrtd.server.exceptions.FunctionNotFound(f'{func} not in dsBaseClient')
         try:
-            if func in self.return_types['plot']:
-                plot_uuid = str(_uuid.uuid4())
-                aspect_mul = 1
-                if (parameters_used['type'] == 'split') | (parameters_used['type'][0] == 'split'):
-                    aspect_mul = len(connection)
-                grDevices.png(
-                    filename=self.storage[connection_uuid]['path_to_temp_plot_storage'] + plot_uuid + '.png', height=10,
-                    width=aspect_mul * 10, units='in', res=300
-                )
-                return_r = getattr(dsBaseClient, func_)(**parameters_used)
-                grDevices.dev_off()
-                return_dict = {'plot_uuid': plot_uuid}
-                self.storage[connection_uuid]['calls'][call_uuid]['plot_uuid'] = plot_uuid
-                if func in self.return_types['return']:
-                    return_dict['return_json'] = helpers.r_to_json(return_r, return_serial_json)
-                self.storage[connection_uuid]['busy'] = False
-                self.storage[connection_uuid]['calls'][call_uuid]['busy'] = False
-                self.function_results_storage[connection_uuid][call_uuid] = return_dict
-                return None
-            else:
-                return_r = getattr(dsBaseClient, func_)(**parameters_used)
-                self.storage[connection_uuid]['busy'] = False
-                self.storage[connection_uuid]['calls'][call_uuid]['busy'] = False
-                if func in self.return_types['return']:
-                    self.function_results_storage[connection_uuid][call_uuid] = helpers.r_to_json(return_r,
-                                                                                                  return_serial_json)
-                    return None
-                self.function_results_storage[connection_uuid][call_uuid] = None
-                return None
+            result = future.result()
         except Exception as err:
-            self.storage[connection_uuid]['busy'] = False
-            self.storage[connection_uuid]['calls'][call_uuid]['busy'] = False
-            if 'datashield.errors' in str(err):
-                err_str = f'Error: \n {str(err)} \n datashield.errors(): \n {str(DSI.datashield_errors())}'
-            else:
-                err_str = f'Error: \n{str(err)}'
-            self.storage[connection_uuid]['calls'][call_uuid]['error'] = err_str
-            raise fdrtd.server.exceptions.InternalServerError(err_str)
+            call['error'] = str(err)
+        else:
+            if step['plot_uuid'] is not None:
+                call['plot_uuid'] = step['plot_uuid']
+            result = self.step_result(step, result)
+            if cache_key is not None:
+                self.result_cache.put(cache_key, cache_generation, result)
+            self.function_results_storage.put((connection_uuid, call_uuid), result)
+        if not step['read_only']:
+            self.result_cache.invalidate(connection_uuid)
+        self.finish(connection_uuid, call)
+        return None
+
+    def call_batch_helper(self, callback: dict, steps, future):
+        connection_uuid = callback['connection']
+        call_uuid = callback['call']
+        call = self.storage[connection_uuid]['calls'][call_uuid]
+        try:
+            results = future.result()
+        except Exception as err:
+            call['error'] = str(err)
+        else:
+            for step, step_status in zip(steps, call['steps']):
+                if step['plot_uuid'] is not None and 'error' not in step_status:
+                    step_status['plot_uuid'] = step['plot_uuid']
+            self.function_results_storage.put((connection_uuid, call_uuid), [
+                None if 'error' in step_status else self.step_result(step, result)
+                for step, step_status, result in zip(steps, call['steps'], results)
+            ])
+        if not all(step['read_only'] for step in steps):
+            self.result_cache.invalidate(connection_uuid)
+        self.finish(connection_uuid, call)
+        return None
+
+    def refresh_catalog(self, connection_uuid, func, matched):
+        catalog = self.catalogs[connection_uuid]
+        missing = catalog.missing(func, matched)
+        if missing is None or catalog.refreshing:
+            return None
+        stale, listing = missing
+        pending = set(self.graphs[connection_uuid].nodes)
+        names = sorted(stale - pending)
+        if not names and (not listing or pending):
+            return None
+        catalog.refreshing = True
+        connection = self.connections[connection_uuid]
+        try:
+            future = get_scheduler().submit(connection_uuid, 'batch', 'catalog', connection['symbol'], names, listing,
+                                            pin=connection['session'])
+        except fdrtd.server.exceptions.ApiError:
+            catalog.refreshing = False
+            return None
+        future.add_done_callback(functools.partial(self.catalog_helper, catalog, catalog.generation))
+        return None
+
+    @staticmethod
+    def catalog_helper(catalog, generation, future):
+        try:
+            catalog.update(future.result(), generation)
+        except Exception:
+            catalog.fail()
+        return None
 
     def logout(self, callback: dict):
         connection_uuid = callback['connection']
-        call_uuid = str(_uuid.uuid4())
-        self.storage[connection_uuid]['calls'][call_uuid] = {
-            'function': 'logout',
-            'warnerror': [],
-            'print': [],
-            'busy': True
-        }
-        self.storage[connection_uuid]['busy'] = True
-        callback.update({'call': call_uuid})
-        Thread(target=self.logout_helper, args=(callback,), daemon=True).start()
+        self.require(connection_uuid)
+        self.new_call(callback, 'logout')
+        self.graphs[connection_uuid].clear()
+        self.result_cache.invalidate(connection_uuid)
+        self.plot_cache.invalidate(connection_uuid)
+        connection = self.connections[connection_uuid]
+        session_pool = get_session_pool()
+        if connection['pooled'] and session_pool.pooled(connection['session']):
+            if self.storage[connection_uuid]['dirty']:
+                job_args = ('reset_session', connection['symbol'], session_pool.parameters(connection['session']))
+            else:
+                job_args = ('ping', connection['symbol'])
+            self.submit_helper(callback, functools.partial(self.release_helper, callback), *job_args)
+        else:
+            self.submit_helper(callback, functools.partial(self.logout_helper, callback), 'logout',
+                               connection['symbol'])
         return self.callback(callback)
 
-    def logout_helper(self, callback: dict):
+    def logout_helper(self, callback: dict, future):
         connection_uuid = callback['connection']
         call_uuid = callback['call']
-        connection = self.connections[connection_uuid]
         call = self.storage[connection_uuid]['calls'][call_uuid]
-        rpy2.rinterface_lib.callbacks.consolewrite_warnerror = lambda e: call['warnerror'].append(e)
-        rpy2.rinterface_lib.callbacks.consolewrite_print = lambda e: call['print'].append(e)
         try:
-            return_r = DSI.datashield_logout(connection)
-            self.storage[connection_uuid]['calls'][call_uuid]['busy'] = False
-            self.storage[connection_uuid]['busy'] = False
-            if isinstance(return_r, type(rpy2.rinterface.NULL)):
-                self.function_results_storage[connection_uuid][call_uuid] = None
-            else:
-                self.function_results_storage[connection_uuid][call_uuid] = helpers.r_to_json(return_r, False)
-            return None
+            self.function_results_storage.put((connection_uuid, call_uuid), future.result())
         except Exception as err:
-            self.storage[connection_uuid]['calls'][call_uuid]['busy'] = False
-            self.storage[connection_uuid]['busy'] = False
-            if 'datashield.errors' in str(err):
-                err_str = f'Error: \n {str(err)} \n datashield.errors(): \n {str(DSI.datashield_errors())}'
-            else:
-                err_str = f'Error: \n{str(err)}'
-            self.storage[connection_uuid]['calls'][call_uuid]['error'] = err_str
-            raise fdrtd.server.exceptions.InternalServerError(err_str)
+            call['error'] = str(err)
+        else:
+            get_executor().release(self.connections.pop(connection_uuid)['session'])
+            self.forget_caches(connection_uuid)
+        self.finish(connection_uuid, call)
+        return None
+
+    def release_helper(self, callback: dict, future):
+        connection_uuid = callback['connection']
+        call_uuid = callback['call']
+        call = self.storage[connection_uuid]['calls'][call_uuid]
+        session = self.connections.pop(connection_uuid)['session']
+        self.forget_caches(connection_uuid)
+        try:
+            future.result()
+        except Exception:
+            get_session_pool().discard(session)
+        else:
+            get_session_pool().release(session)
+        self.function_results_storage.put((connection_uuid, call_uuid), None)
+        self.finish(connection_uuid, call)
+        return None
+
+    def forget_caches(self, connection_uuid):
+        self.result_cache.forget(connection_uuid)
+        self.plot_cache.forget(connection_uuid)
+
+    def finish(self, connection_uuid, call):
+        self.status_board.finish(call)
+        self.update_busy(connection_uuid)
+        self.metrics.observe_record('call', call, function=call['function'])
 
-    def get_status(self, callback):
+    def get_metrics(self, callback=None):
+        return self.metrics.render()
+
+    def get_plot(self, callback, plot_uuid=None, plot_format='png', width=None, height=10, res=300, preview=False):
+        connection_uuid = callback.get('connection')
+        self.require(connection_uuid)
+        if plot_uuid is None:
+            try:
+                plot_uuid = self.storage[connection_uuid]['calls'][callback.get('call')]['plot_uuid']
+            except KeyError:
+                raise fdrtd.server.exceptions.MissingParameter('plot_uuid')
+        if plot_format not in helpers.plot_formats:
+            raise fdrtd.server.exceptions.InvalidParameter('plot_format', plot_format)
+        if preview:
+            res = settings.plot_preview_res
+        width, height, res = None if width is None else float(width), float(height), int(res)
+        options = {'plot_format': plot_format, 'width': width, 'height': height, 'res': res}
+        key = self.plot_cache.key(connection_uuid, plot_uuid, options)
+        hit, plot = self.plot_cache.get(key)
+        if hit:
+            return plot
+        generation = self.plot_cache.generation(connection_uuid)
+        future = get_executor().submit('render_plot', self.connections[connection_uuid]['symbol'], plot_uuid,
+                                       plot_format, width, height, res,
+                                       pin=self.connections[connection_uuid]['session'])
+        try:
+            data = future.result()
+        except fdrtd.server.exceptions.ApiError:
+            raise
+        except Exception as err:
+            raise fdrtd.server.exceptions.InternalServerError(str(err))
+        plot = {'plot_uuid': plot_uuid, 'plot_format': plot_format, 'content_type': helpers.plot_formats[plot_format],
+                'data': base64.b64encode(data).decode()}
+        self.plot_cache.put(key, generation, plot)
+        return plot
+
+    def get_status(self, callback, cursor=None, timeout=0, memory=False):
         connection_uuid = callback.get('connection')
         call_uuid = callback.get('call')
+        if connection_uuid in self.snapshots:
+            self.require(connection_uuid)
+        if call_uuid is None and connection_uuid in self.storage:
+            status = dict((key, value) for key, value in self.storage[connection_uuid].items() if key != 'calls')
+            status['calls'] = len(self.storage[connection_uuid]['calls'])
+            status['cache'] = self.result_cache.get_status(connection_uuid)
+            status['results'] = self.function_results_storage.get_status()
+            status['executor'] = get_executor().get_status()
+            status['scheduler'] = get_scheduler().get_status()
+            if connection_uuid in self.graphs:
+                status['deferred'] = self.graphs[connection_uuid].get_status()
+                status['catalog'] = self.catalogs[connection_uuid].get_status()
+            if memory and connection_uuid in self.connections:
+                status['memory'] = self.session_memory(connection_uuid)
+            return status
         try:
-            return self.storage[connection_uuid]['calls'][call_uuid]
+            record = self.storage[connection_uuid]['calls'][call_uuid]
         except KeyError:
             if connection_uuid not in self.storage:
                 raise fdrtd.server.exceptions.MissingParameter(f'connection {connection_uuid}')
             else:
                 raise fdrtd.server.exceptions.MissingParameter(f'call {call_uuid}')
+        if cursor is not None:
+            record = self.status_board.poll(record, cursor, timeout)
+        future = self.futures.get((connection_uuid, call_uuid))
+        queue = None if future is None else get_scheduler().position(future)
+        if queue is None:
+            return record
+        return dict(record, queue=queue)
+
+    def session_memory(self, connection_uuid):
+        connection = self.connections[connection_uuid]
+        future = get_executor().submit('session_memory', connection['symbol'], pin=connection['session'])
+        try:
+            return future.result()
+        except fdrtd.server.exceptions.ApiError:
+            raise
+        except Exception as err:
+            raise fdrtd.server.exceptions.InternalServerError(str(err))
 
-    def get_result(self, callback):
+    def get_result(self, callback, offset=0, limit=None):
+        offset = int(offset)
+        limit = None if limit is None else int(limit)
+        if offset < 0:
+            raise fdrtd.server.exceptions.InvalidParameter('offset', offset)
+        if limit is not None and limit < 0:
+            raise fdrtd.server.exceptions.InvalidParameter('limit', limit)
+        if offset == 0 and limit is None:
+            return self.stored_result(callback, self.function_results_storage.get)
+        return self.stored_result(callback, functools.partial(self.function_results_storage.get_page,
+                                                              offset=offset, limit=limit))
+
+    def get_result_metadata(self, callback):
+        return self.stored_result(callback, self.function_results_storage.get_metadata)
+
+    def stored_result(self, callback, read):
         connection_uuid = callback.get('connection')
         call_uuid = callback.get('call')
         try:
-            return self.function_results_storage[connection_uuid][call_uuid]
+            return read((connection_uuid, call_uuid))
         except KeyError:
-            if connection_uuid not in self.function_results_storage:
+            if connection_uuid not in self.storage:
                 raise fdrtd.server.exceptions.MissingParameter(f'connection {connection_uuid}')
             else:
                 raise fdrtd.server.exceptions.MissingParameter(f'call {call_uuid}')
@@ -0,0 +1,153 @@
+import re
+from threading import RLock
+
+symbol_pattern = re.compile(r'(?<![\w.$"\'])([A-Za-z.][\w.]*)(?![\w.]*\s*\()')
+
+expressions = {
+    'ds.assign': lambda matched: matched['toAssign'],
+    'ds.exp': lambda matched: 'exp(%s)' % matched['x'],
+    'ds.log': lambda matched: 'log(%s)' % matched['x'] if 'base' not in matched
+    else 'log(%s, %s)' % (matched['x'], matched['base']),
+    'ds.abs': lambda matched: 'absDS(%s)' % matched['x'],
+    'ds.sqrt': lambda matched: 'sqrtDS(%s)' % matched['x']
+}
+
+deferrable = {
+    'ds.assign': {'toAssign', 'newobj'},
+    'ds.exp': {'x', 'newobj'},
+    'ds.log': {'x', 'base', 'newobj'},
+    'ds.abs': {'x', 'newobj'},
+    'ds.sqrt': {'x', 'newobj'},
+    'ds.c': {'x', 'newobj'},
+    'ds.replaceNA': {'x', 'forNA', 'newobj'}
+}
+
+
+def symbols(value):
+    if isinstance(value, str):
+        return set(symbol_pattern.findall(value)) - {'TRUE', 'FALSE', 'NA', 'NULL', 'Inf', 'NaN'}
+    if isinstance(value, (list, tuple)):
+        return set().union(*(symbols(element) for element in value))
+    if isinstance(value, dict):
+        return set().union(*(symbols(element) for element in value.values()))
+    return set()
+
+
+def atomic(expression):
+    if re.fullmatch(r'[A-Za-z.][\w.]*(\$[\w.]+)?', expression):
+        return True
+    name = re.match(r'[A-Za-z.][\w.]*\(', expression)
+    if name is None or '"' in expression or "'" in expression:
+        return False
+    depth = 0
+    for position, character in enumerate(expression[name.end() - 1:], name.end() - 1):
+        depth += {'(': 1, ')': -1}.get(character, 0)
+        if depth == 0:
+            return position == len(expression) - 1
+    return False
+
+
+class AssignmentGraph:
+
+    def __init__(self):
+        self.nodes = {}
+        self.deferred = 0
+        self.fused = 0
+        self.dropped = 0
+        self.materialized = 0
+        self.lock = RLock()
+
+    def defer(self, func, matched, parameters):
+        if func not in deferrable or 'newobj' not in matched or 'servers' in parameters \
+                or not set(matched) <= deferrable[func]:
+            return False
+        output = matched['newobj']
+        with self.lock:
+            if not isinstance(output, str) or self.dependents(output):
+                return False
+            if func in expressions and isinstance(matched.get('x', ''), str):
+                expression, fused = self.fuse(expressions[func](matched))
+                node = {'step': {'func': 'ds.assign', 'parameters': {'toAssign': expression, 'newobj': output}},
+                        'expression': expression, 'inputs': symbols(expression), 'sending': False}
+            else:
+                fused = 0
+                node = {'step': {'func': func, 'parameters': parameters}, 'expression': None, 'sending': False,
+                        'inputs': symbols(dict((key, value) for key, value in matched.items() if key != 'newobj'))}
+            if output in node['inputs']:
+                if output in self.nodes:
+                    return False
+                node['inputs'].discard(output)
+            if output in self.nodes and not self.nodes[output]['sending']:
+                self.dropped += 1
+            self.nodes[output] = node
+            self.deferred += 1
+            self.fused += fused
+        return True
+
+    def fuse(self, expression):
+        fused = []
+
+        def replace(match):
+            node = self.nodes.get(match.group(1))
+            if node is None or node['expression'] is None or not atomic(node['expression']):
+                return match.group(0)
+            fused.append(match.group(1))
+            return node['expression']
+
+        return symbol_pattern.sub(replace, expression), len(fused)
+
+    def dependents(self, symbol):
+        return [output for output, node in self.nodes.items() if symbol in node['inputs'] and output != symbol]
+
+    def materialize(self, needed=None):
+        outputs = []
+        visited = set()
+
+        def visit(output):
+            if output not in self.nodes or output in visited or self.nodes[output]['sending']:
+                return None
+            visited.add(output)
+            for symbol in sorted(self.nodes[output]['inputs'] - {output}):
+                visit(symbol)
+            outputs.append(output)
+            return None
+
+        with self.lock:
+            for output in list(self.nodes) if needed is None else sorted(needed):
+                visit(output)
+        return outputs
+
+    def read(self, value):
+        with self.lock:
+            return self.materialize(symbols(value) & set(self.nodes))
+
+    @staticmethod
+    def steps(sent):
+        return [node['step'] for _, node in sent]
+
+    def send(self, outputs):
+        with self.lock:
+            sent = [(output, self.nodes[output]) for output in outputs if not self.nodes[output]['sending']]
+            for _, node in sent:
+                node['sending'] = True
+        return sent
+
+    def forget(self, sent, succeeded):
+        with self.lock:
+            for index, (output, node) in enumerate(sent):
+                node['sending'] = False
+                if index < succeeded and self.nodes.get(output) is node:
+                    del self.nodes[output]
+                    self.materialized += 1
+
+    def clear(self):
+        with self.lock:
+            self.dropped += len(self.nodes)
+            self.nodes.clear()
+
+    def get_status(self):
+        with self.lock:
+            return {'pending': sorted(self.nodes), 'sending': sorted(output for output, node in self.nodes.items()
+                                                                      if node['sending']),
+                    'deferred': self.deferred, 'fused': self.fused, 'dropped': self.dropped,
+                    'materialized': self.materialized}
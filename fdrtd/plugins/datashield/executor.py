@@ -0,0 +1,166 @@
+import functools
+import heapq
+import itertools
+import logging
+import queue
+import time
+from concurrent.futures import Future, InvalidStateError
+from threading import Condition, Lock, Thread
+
+import fdrtd.server
+from fdrtd.plugins.datashield import runtime, settings
+
+
+def overloaded(max_queue_size):
+    return fdrtd.server.exceptions.ApiError(503, f'overloaded: {max_queue_size} R jobs already queued')
+
+
+class Cancelled(Exception):
+    pass
+
+
+def finish_future(future, result=None, exception=None):
+    try:
+        if exception is None:
+            future.set_result(result)
+        else:
+            future.set_exception(exception)
+    except InvalidStateError:
+        return False
+    return True
+
+
+def track_first_call(first_calls, job, future):
+    if job not in first_calls:
+        start = time.monotonic()
+        future.add_done_callback(lambda _: first_calls.setdefault(job, time.monotonic() - start))
+
+
+def log_warm_up(future):
+    try:
+        logging.info(f'R runtime warmed up: {future.result()}')
+    except Exception as err:
+        logging.error(f'R runtime warm-up failed: {err}')
+
+
+class RExecutor:
+
+    def __init__(self, max_queue_size):
+        self.jobs = queue.Queue(maxsize=max_queue_size)
+        self.first_calls = {}
+        self.current = None
+        self.lock = Lock()
+        self.thread = Thread(target=self.run, name='datashield-R-executor', daemon=True)
+        self.thread.start()
+
+    def submit(self, job, *args, console=None, pin=None, among=None):
+        future = Future()
+        try:
+            self.jobs.put_nowait((future, job, args, console))
+        except queue.Full:
+            raise overloaded(self.jobs.maxsize)
+        track_first_call(self.first_calls, job, future)
+        return future
+
+    def release(self, pin):
+        return None
+
+    def pinned_worker(self, pin):
+        return 0
+
+    def worker_index(self, future):
+        return 0
+
+    def cancel(self, future, reason):
+        with self.lock:
+            if future is self.current:
+                runtime.interrupt()
+            return finish_future(future, exception=Cancelled(reason))
+
+    def warm_up(self):
+        self.submit('warm_up').add_done_callback(log_warm_up)
+
+    def run(self):
+        import rpy2.rinterface_lib.callbacks as callbacks
+        from fdrtd.plugins.datashield import jobs
+        consolewrite_warnerror_backup = callbacks.consolewrite_warnerror
+        consolewrite_print_backup = callbacks.consolewrite_print
+        consolewrite_status_backup = jobs.consolewrite_status
+        while True:
+            future, job, args, console = self.jobs.get()
+            with self.lock:
+                if not future.done() and future.set_running_or_notify_cancel():
+                    self.current = future
+            if self.current is future:
+                if console is not None:
+                    console('timings', {'started': time.time()})
+                    callbacks.consolewrite_warnerror = functools.partial(console, 'warnerror')
+                    callbacks.consolewrite_print = functools.partial(console, 'print')
+                    jobs.consolewrite_status = console
+                try:
+                    finish_future(future, getattr(jobs, job)(*args))
+                except (Exception, KeyboardInterrupt) as err:
+                    logging.exception(repr(err))
+                    finish_future(future, exception=err)
+                finally:
+                    callbacks.consolewrite_warnerror = consolewrite_warnerror_backup
+                    callbacks.consolewrite_print = consolewrite_print_backup
+                    jobs.consolewrite_status = consolewrite_status_backup
+                    with self.lock:
+                        self.current = None
+                        runtime.interrupt(0)
+            self.jobs.task_done()
+
+    def get_status(self):
+        return {'queued': self.jobs.qsize(), 'max_queue_size': self.jobs.maxsize, 'first_calls': self.first_calls,
+                'runtime': runtime.get_status()}
+
+
+class Deadlines:
+
+    def __init__(self):
+        self.heap = []
+        self.counter = itertools.count()
+        self.changed = Condition()
+        Thread(target=self.run, name='datashield-deadlines', daemon=True).start()
+
+    def add(self, timeout, callback):
+        with self.changed:
+            heapq.heappush(self.heap, (time.monotonic() + timeout, next(self.counter), callback))
+            self.changed.notify()
+
+    def run(self):
+        while True:
+            with self.changed:
+                while not self.heap or self.heap[0][0] > time.monotonic():
+                    self.changed.wait(self.heap[0][0] - time.monotonic() if self.heap else None)
+                _, _, callback = heapq.heappop(self.heap)
+            try:
+                callback()
+            except Exception as err:
+                logging.exception(repr(err))
+
+
+r_executor = None
+r_executor_lock = Lock()
+deadlines = None
+
+
+def get_executor():
+    global r_executor
+    with r_executor_lock:
+        if r_executor is None:
+            if settings.worker_processes > 0:
+                from fdrtd.plugins.datashield.workers import RWorkerPool
+                r_executor = RWorkerPool(settings.worker_processes, settings.executor_queue_size)
+            else:
+                r_executor = RExecutor(settings.executor_queue_size)
+        return r_executor
+
+
+def get_deadlines():
+    global deadlines
+    with r_executor_lock:
+        if deadlines is None:
+            deadlines = Deadlines()
+        return deadlines
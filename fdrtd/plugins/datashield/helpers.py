@@ -1,17 +1,44 @@
+import base64
 import numpy as np
 import json
+import socket
+import time
+import urllib.parse
 
 import rpy2
-from rpy2.robjects.packages import importr
+from rpy2 import rinterface
 
 import fdrtd.server
+from fdrtd.plugins.datashield import runtime
 
-base = importr('base')
-DSI = importr('DSI')
-dsBaseClient = importr('dsBaseClient')
-jsonlite_R = importr('jsonlite')
+base = runtime.LazyPackage('base')
+jsonlite_R = runtime.LazyPackage('jsonlite')
 
 types_dict = {'integer': int, 'double': float, 'character': str, 'complex': complex, 'logical': bool}
+r_types_dict = {
+    rinterface.RTYPES.INTSXP: 'integer', rinterface.RTYPES.REALSXP: 'double', rinterface.RTYPES.STRSXP: 'character',
+    rinterface.RTYPES.CPLXSXP: 'complex', rinterface.RTYPES.LGLSXP: 'logical'
+}
+
+numpy_dtypes_dict = {
+    rinterface.RTYPES.INTSXP: np.int32, rinterface.RTYPES.REALSXP: np.float64, rinterface.RTYPES.CPLXSXP: np.complex128,
+    rinterface.RTYPES.LGLSXP: np.int32
+}
+# names of the NA singletons in rinterface, which rpy2 only sets once R is initialized
+na_values = {
+    rinterface.RTYPES.INTSXP: 'NA_Integer', rinterface.RTYPES.LGLSXP: 'NA_Logical',
+    rinterface.RTYPES.STRSXP: 'NA_Character'
+}
+result_formats = {'json', 'columnar'}
+plot_formats = {'png': 'image/png', 'svg': 'image/svg+xml', 'pdf': 'application/pdf'}
+result_options = ('servers', 'result_format', 'return_serial_JSON', 'convert_via_JSON')
+catalog_functions = ('ds.class', 'ds.colnames', 'ds.dim', 'ds.length')
+
+# zero-based positions of NA (but not NaN) elements of double and complex vectors, where NA is just one of the NaNs
+na_positions_R = '''function(x) {
+    x <- unclass(x)
+    if (is.double(x) || is.complex(x)) which(is.na(x) & !is.nan(x)) - 1L else which(is.na(x)) - 1L
+}'''
 
 
 def first_sweep(d):
@@ -56,28 +83,32 @@ def second_sweep(d):
     elif d is None:
         return d
     else:
-        if set(d.keys()) == {'value'}:
+        keys = set(d.keys())
+        if keys == {'value'}:
             return second_sweep(d['value'])
-        elif set(d.keys()) == {'value', 'names'}:
-            if not isinstance(second_sweep(d['value']), list):
-                return {second_sweep(d['names']): second_sweep(d['value'])}
+        elif keys == {'value', 'names'}:
+            value = second_sweep(d['value'])
+            if not isinstance(value, list):
+                return {second_sweep(d['names']): value}
             else:
-                return dict(zip(second_sweep(d['names']), second_sweep(d['value'])))
-        elif set(d.keys()) == {'value', 'dim', 'dimnames'}:
-            if isinstance(second_sweep(d['dim']), list):
-                templist = np.reshape(second_sweep(d['value']), second_sweep(d['dim'])[::-1]).T.tolist()
-                if isinstance(second_sweep(d['dimnames']), list):
-                    if isinstance(second_sweep(d['dimnames'])[1], list):
-                        colnames = [None] + second_sweep(d['dimnames'])[1]
+                return dict(zip(second_sweep(d['names']), value))
+        elif keys == {'value', 'dim', 'dimnames'}:
+            dim = second_sweep(d['dim'])
+            dimnames = second_sweep(d['dimnames'])
+            if isinstance(dim, list):
+                templist = np.reshape(second_sweep(d['value']), dim[::-1]).T.tolist()
+                if isinstance(dimnames, list):
+                    if isinstance(dimnames[1], list):
+                        colnames = [None] + dimnames[1]
                     else:
-                        colnames = [None] + [second_sweep(d['dimnames'])[1]]
+                        colnames = [None] + [dimnames[1]]
                     if len(templist) > 1:
                         for i in range(len(templist)):
-                            templist[i] = [second_sweep(d['dimnames'])[0][i]] + templist[i]
+                            templist[i] = [dimnames[0][i]] + templist[i]
                     else:
-                        templist[0] = [second_sweep(d['dimnames'])[0]] + templist[0]
+                        templist[0] = [dimnames[0]] + templist[0]
                     return [colnames] + templist
-                elif isinstance(second_sweep(d['dimnames']), dict):
+                elif isinstance(dimnames, dict):
                     tempdimnames = second_sweep(d['dimnames']['value'])
                     rowcoltitles = second_sweep(d['dimnames']['names'])
                     if tempdimnames[0] is not None:
@@ -91,64 +122,215 @@ def second_sweep(d):
                         else:
                             return {rowcoltitles[1]: templist}
             else:
-                return second_sweep(d['dimnames']) + second_sweep(d['value'])
-        elif set(d.keys()) == {'value', 'names', 'row.names', 'class'}:
+                return dimnames + second_sweep(d['value'])
+        elif keys == {'value', 'names', 'row.names', 'class'}:
             templist = np.array(second_sweep(d['value'])).T.tolist()
             colnames = [None] + second_sweep(d['names'])
-            if isinstance(second_sweep(d['row.names']), list):
+            row_names = second_sweep(d['row.names'])
+            if isinstance(row_names, list):
                 for i in range(len(templist)):
-                    templist[i] = [second_sweep(d['row.names'])[i]] + templist[i]
+                    templist[i] = [row_names[i]] + templist[i]
             else:
-                templist = [[second_sweep(d['row.names'])] + templist]
+                templist = [[row_names] + templist]
             return {'value': [colnames] + templist, 'class': second_sweep(d['class'])}
-        elif set(d.keys()) == {'value', 'logarithm'}:
+        elif keys == {'value', 'logarithm'}:
             if second_sweep(d['logarithm']):
                 return np.e ** second_sweep(d['value'])
             else:
                 return second_sweep(d['value'])
-        elif set(d.keys()) == {'value', 'names', 'class'}:
-            if not isinstance(second_sweep(d['value']), list):
-                return {second_sweep(d['names']): second_sweep(d['value']), 'class': second_sweep(d['class'])}
+        elif keys == {'value', 'names', 'class'}:
+            value = second_sweep(d['value'])
+            if not isinstance(value, list):
+                return {second_sweep(d['names']): value, 'class': second_sweep(d['class'])}
             else:
-                tempd = dict(zip(second_sweep(d['names']), second_sweep(d['value'])))
+                tempd = dict(zip(second_sweep(d['names']), value))
                 tempd.update({'class': second_sweep(d['class'])})
                 return tempd
         else:
             return d
 
 
-def r_to_json(output, return_serial_json):
+def na_positions(output, values):
+    if output.typeof in na_values:
+        na = getattr(rinterface, na_values[output.typeof])
+        return [i for i, value in enumerate(values) if value is na]
+    if any(value != value for value in values):
+        return list(runtime.function('na_positions', na_positions_R)(output))
+    return []
+
+
+def native_sweep(output):
+    r_type = output.typeof
+    if r_type == rinterface.RTYPES.NILSXP:
+        return None
+    elif r_type == rinterface.RTYPES.VECSXP:
+        value = [native_sweep(element) for element in output]
+        if len(value) == 1:
+            value = value[0]
+        tempd = {'value': value}
+        for key in output.list_attrs():
+            tempd[key] = native_sweep(output.do_slot(key))
+        return tempd
+    elif r_type in r_types_dict:
+        cast = types_dict[r_types_dict[r_type]]
+        values = list(output)
+        na = set(na_positions(output, values))
+        if na:
+            templist = ['NA' if i in na else cast(val) for i, val in enumerate(values)]
+        else:
+            templist = list(map(cast, values))
+        if len(templist) == 1:
+            templist = templist[0]
+        attributes = list(output.list_attrs())
+        if not attributes:
+            return templist
+        tempd = {'value': templist}
+        for key in attributes:
+            tempd[key] = native_sweep(output.do_slot(key))
+        return tempd
+    else:
+        return first_sweep(json.loads(jsonlite_R.serializeJSON(output)[0]))
+
+
+def r_to_python(output):
+    return second_sweep(native_sweep(output))
+
+
+def r_to_json(output, return_serial_json, via_json=False):
     if return_serial_json:
         return jsonlite_R.serializeJSON(output)[0]
-    else:
+    elif via_json:
         return second_sweep(first_sweep(json.loads(jsonlite_R.serializeJSON(output)[0])))
+    else:
+        return r_to_python(output)
 
 
-def defaults(func, parameters=None, **kwargs):
-    if parameters is None:
-        parameters = {}
-    parameters.update(**kwargs)
-    combined = {}
+def column_buffer(output, r_type):
+    if r_type == rinterface.RTYPES.STRSXP:
+        data = list(output)
+        for i in na_positions(output, data):
+            data[i] = None
+        return {'dtype': 'str', 'length': len(data), 'data': data, 'validity': None}
+    array = np.frombuffer(output.memoryview(), dtype=numpy_dtypes_dict[r_type])
+    if r_type in (rinterface.RTYPES.INTSXP, rinterface.RTYPES.LGLSXP):
+        na = np.flatnonzero(array == np.iinfo(np.int32).min)
+    elif np.isnan(array).any():
+        na = list(runtime.function('na_positions', na_positions_R)(output))
+    else:
+        na = []
+    validity = None
+    if len(na):
+        mask = np.ones(len(array), dtype=np.bool_)
+        mask[na] = False
+        array = array.copy()
+        array[na] = 0
+        validity = base64.b64encode(np.packbits(mask, bitorder='little').tobytes()).decode('ascii')
+    if r_type == rinterface.RTYPES.LGLSXP:
+        array = array.astype(np.bool_)
+    return {
+        'dtype': array.dtype.str,
+        'length': len(array),
+        'data': base64.b64encode(array.data).decode('ascii'),
+        'validity': validity
+    }
+
+
+def r_to_columnar(output):
+    r_type = output.typeof
+    if r_type == rinterface.RTYPES.NILSXP:
+        return None
+    attributes = dict((key, output.do_slot(key)) for key in output.list_attrs())
+    envelope = {}
+    if 'class' in attributes:
+        envelope['class'] = list(attributes.pop('class'))
+    if 'names' in attributes:
+        envelope['names'] = list(attributes.pop('names'))
+    if r_type == rinterface.RTYPES.VECSXP:
+        if 'data.frame' in envelope.get('class', []):
+            row_names = attributes.pop('row.names')
+            envelope.update({
+                'type': 'data.frame',
+                'nrow': len(row_names),
+                'row.names': r_to_columnar(row_names),
+                'columns': [r_to_columnar(column) for column in output]
+            })
+        else:
+            envelope.update({'type': 'list', 'value': [r_to_columnar(element) for element in output]})
+    elif r_type in r_types_dict:
+        if 'dim' in attributes and len(attributes['dim']) == 2:
+            envelope.update({'type': 'matrix', 'shape': list(attributes.pop('dim')), 'order': 'F'})
+            if 'dimnames' in attributes:
+                dimnames = attributes.pop('dimnames')
+                envelope['dimnames'] = [None if names.typeof == rinterface.RTYPES.NILSXP else list(names)
+                                        for names in dimnames]
+                if 'names' in dimnames.list_attrs():
+                    envelope['dimnames.names'] = list(dimnames.do_slot('names'))
+        else:
+            envelope['type'] = 'vector'
+        envelope.update(column_buffer(output, r_type))
+    else:
+        return {'type': 'object', 'value': r_to_python(output)}
+    if attributes:
+        envelope['attributes'] = dict((key, r_to_python(value)) for key, value in attributes.items())
+    return envelope
+
+
+def convert_result(output, parameters):
+    if parameters.get('result_format', 'json') == 'columnar':
+        return r_to_columnar(output)
+    return r_to_json(output, parameters.get('return_serial_JSON', False), parameters.get('convert_via_JSON', False))
+
+
+def parameter_aliases(formals):
+    aliases = []
+    for key in formals:
+        candidates = [key]
+        if key[-5:] == '.name':
+            candidates.append(key[:-5])
+        if key.replace('.', '_') != key:
+            candidates.append(key.replace('.', '_'))
+        aliases.append((key, tuple(candidates)))
+    return tuple(aliases)
+
+
+def match_aliases(aliases, parameters):
+    matched = {}
+    for key, candidates in aliases:
+        for candidate in candidates:
+            if candidate in parameters:
+                matched[key] = parameters[candidate]
+                break
+    return matched
+
+
+def match_parameters(formals, parameters):
+    return match_aliases(parameter_aliases(formals), parameters)
+
+
+def call_plan(func):
     formals = func.formals()
     if isinstance(formals, type(rpy2.rinterface.NULL)):
         formals = {}
     else:
         formals = dict((n, o[0]) for n, o in formals.items())
-    for key in formals:
-        if key not in parameters:
-            if key[-5:] == '.name' and key[:-5] in parameters:
-                combined[key] = parameters[key[:-5]]
-            elif key.replace('.', '_') in parameters:
-                combined[key] = parameters[key.replace('.', '_')]
-            else:
-                combined[key] = formals[key]
-        else:
-            combined[key] = parameters[key]
-    return combined
+    return {'function': func, 'defaults': formals, 'aliases': parameter_aliases(formals)}
 
 
-def login_params_string_builder(parameters, uuid):
-    r_params = 'logins=builder%s$build()' % uuid.replace('-', '')
+def plan_parameters(plan, parameters):
+    parameters_used = dict(plan['defaults'])
+    parameters_used.update(match_aliases(plan['aliases'], parameters))
+    return parameters_used
+
+
+def defaults(func, parameters=None, **kwargs):
+    if parameters is None:
+        parameters = {}
+    parameters.update(**kwargs)
+    return plan_parameters(call_plan(func), parameters)
+
+
+def r_params_string_builder(parameters):
+    r_params = ''
     for key in parameters:
         if key in {'assign', 'missings'}:
             r_params += f', {key}={str(parameters[key]).upper()}'
@@ -165,6 +347,10 @@ def login_params_string_builder(parameters, uuid):
     return r_params
 
 
+def login_params_string_builder(parameters):
+    return 'logins=session$builder$build()' + r_params_string_builder(parameters)
+
+
 def handle_error(err, func):
     if func == 'login':
         if 'The server parameter cannot be empty' in err:
@@ -187,3 +373,15 @@ def extract_connections(connections, parameters_servers):
     else:
         connection = connections.rx(parameters_servers)
     return connection
+
+
+def unreachable(server, timeout):
+    url = urllib.parse.urlsplit(str(server.get('url', '')))
+    if url.scheme not in ('http', 'https') or not url.hostname:
+        return None
+    start = time.monotonic()
+    try:
+        socket.create_connection((url.hostname, url.port or (443 if url.scheme == 'https' else 80)), timeout).close()
+    except (OSError, ValueError) as err:
+        return {'error': f'Error: \n{url.netloc} cannot be reached: {err}', 'latency': time.monotonic() - start}
+    return None
@@ -0,0 +1,371 @@
+import os
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from rpy2 import rinterface
+
+import fdrtd.server
+from fdrtd.plugins.datashield import helpers, runtime, settings
+from fdrtd.plugins.datashield.sessions import session_symbol
+
+base = runtime.LazyPackage('base')
+DSI = runtime.LazyPackage('DSI')
+dsBaseClient = runtime.LazyPackage('dsBaseClient')
+grDevices = runtime.LazyPackage('grDevices')
+
+
+class RError(Exception):
+    pass
+
+
+def consolewrite_status(stream, status):
+    return None
+
+
+plans = {}
+
+
+def call_plan(func):
+    if func not in plans:
+        plans[func] = helpers.call_plan(getattr(dsBaseClient, func.replace('.', '_')))
+    return plans[func]
+
+
+def error_string(err):
+    if 'datashield.errors' in str(err):
+        return f'Error: \n {str(err)} \n datashield.errors(): \n {str(DSI.datashield_errors())}'
+    return f'Error: \n{str(err)}'
+
+
+def list_formals():
+    return dict((func, list(call_plan(func)['defaults'])) for func in base.ls('package:dsBaseClient'))
+
+
+def warm_up():
+    return runtime.warm_up()
+
+
+def new_session(uuid):
+    session = base.new_env()
+    runtime.robjects().globalenv[session_symbol(uuid)] = session
+    return session
+
+
+def connections(symbol):
+    return runtime.robjects().globalenv[symbol]['connections']
+
+
+def release_session(symbol):
+    globalenv = runtime.robjects().globalenv
+    if symbol in globalenv:
+        del globalenv[symbol]
+    base.gc()
+
+
+def login(uuid, list_of_servers, parameters):
+    runtime.package('DSOpal')
+    session = new_session(uuid)
+    try:
+        session['builder'] = builder = DSI.newDSLoginBuilder()
+        for server in list_of_servers:
+            try:
+                builder['append'](**server)
+            except Exception as err:
+                raise helpers.handle_error(str(err), 'login')
+        start = time.monotonic()
+        try:
+            runtime.robjects().r('function(session) session$connections <- DSI::datashield.login(%s)'
+                                 % helpers.login_params_string_builder(parameters))(session)
+        except Exception as err:
+            raise helpers.handle_error(str(err), 'login')
+        consolewrite_status('timings', {'r': time.monotonic() - start})
+    except Exception:
+        release_session(session_symbol(uuid))
+        raise
+    return session_symbol(uuid)
+
+
+def login_servers(uuid, list_of_servers, parameters, server_timeout, extend=False):
+    runtime.package('DSOpal')
+    r = runtime.robjects().r
+    symbol = session_symbol(uuid)
+    if extend:
+        if symbol not in runtime.robjects().globalenv:
+            return {'symbol': None, 'servers': []}
+        session = runtime.robjects().globalenv[symbol]
+    else:
+        session = new_session(uuid)
+        session['builder'] = builder = DSI.newDSLoginBuilder()
+        for server in list_of_servers:
+            try:
+                builder['append'](**server)
+            except Exception as err:
+                release_session(symbol)
+                raise helpers.handle_error(str(err), 'login')
+    login_server = r('function(builder, timeout) { setTimeLimit(elapsed=timeout, transient=TRUE); '
+                     'on.exit(setTimeLimit(elapsed=Inf)); DSI::datashield.login(logins=builder$build()%s) }'
+                     % helpers.r_params_string_builder(parameters))
+    server_connections = [session['connections']] if extend else []
+    statuses = []
+    with ThreadPoolExecutor(max_workers=max(min(len(list_of_servers), 32), 1)) as pool:
+        probes = list(pool.map(lambda server: helpers.unreachable(server, server_timeout), list_of_servers))
+    for server, probe in zip(list_of_servers, probes):
+        status = {'server': server.get('server')}
+        if probe is not None:
+            status.update(probe)
+            consolewrite_status('servers', status)
+            statuses.append(status)
+            continue
+        start = time.monotonic()
+        try:
+            builder = DSI.newDSLoginBuilder()
+            builder['append'](**server)
+            server_connections.append(login_server(builder, server_timeout))
+        except Exception as err:
+            status['error'] = error_string(err)
+        status['latency'] = time.monotonic() - start
+        consolewrite_status('servers', status)
+        statuses.append(status)
+    if not server_connections:
+        release_session(symbol)
+        raise RError('login failed on all servers:\n' + '\n'.join(
+            f"{status['server']}: {status['error']}" for status in statuses
+        ))
+    session['connections'] = base.c(*server_connections)
+    return {'symbol': symbol, 'servers': statuses}
+
+
+def ping(symbol):
+    DSI.datashield_symbols(connections(symbol))
+    return True
+
+
+def reset_session(symbol, parameters):
+    r_code = 'conns <- session$connections; ' \
+             'for (symbol in unique(unlist(DSI::datashield.symbols(conns)))) DSI::datashield.rm(conns, symbol)'
+    if str(parameters.get('assign', False)).upper() == 'TRUE':
+        assign_parameters = dict((key, parameters[key]) for key in ('symbol', 'variables', 'missings', 'id_name',
+                                                                    'id.name') if key in parameters)
+        assign_parameters.setdefault('symbol', 'D')
+        r_code += '; logins <- session$builder$build(); DSI::datashield.assign.table(conns, ' \
+                  'table=logins$table[match(names(conns), logins$server)]%s)' \
+                  % helpers.r_params_string_builder(assign_parameters)
+    session = runtime.robjects().globalenv[symbol]
+    remove_plots(session)
+    try:
+        runtime.robjects().r('function(session) {%s}' % r_code)(session)
+    except Exception as err:
+        raise RError(error_string(err))
+    return None
+
+
+def save_workspace(symbol, workspace):
+    try:
+        DSI.datashield_workspace_save(connections(symbol), workspace)
+    except Exception as err:
+        raise RError(error_string(err))
+    return workspace
+
+
+def remove_workspace(symbol, workspace):
+    try:
+        DSI.datashield_workspace_rm(connections(symbol), workspace)
+    except Exception as err:
+        raise RError(error_string(err))
+    return None
+
+
+def session_memory(symbol):
+    return dict(zip(('session_bytes', 'r_heap_bytes'), runtime.function('session_memory', '''function(session) c(
+    sum(vapply(ls(session, all.names=TRUE), function(name) as.numeric(object.size(get(name, envir=session))), 0)),
+    sum(gc()[, 2]) * 1048576
+)''')(runtime.robjects().globalenv[symbol])))
+
+
+def heap_size():
+    return runtime.function('heap_size', 'function() sum(gc()[, 2]) * 1048576')()[0]
+
+
+def remove_plots(session):
+    if 'plots' in session:
+        del session['plots']
+
+
+# drops the recorded plots that were not rendered or recorded since expired and, beyond the keep most recently
+# used ones, the least recently used
+evict_plots_R = '''function(plots, keep, expired) {
+    used <- vapply(ls(plots), function(name) plots[[name]]$used, 0)
+    rm(list=names(used)[used < expired | rank(-used, ties.method="first") > keep], envir=plots)
+}'''
+
+
+def record_plot(symbol, plot_uuid, function, parameters_used, aspect):
+    grDevices.pdf(file=rinterface.NULL)
+    try:
+        grDevices.dev_control('enable')
+        return_r = function(**parameters_used)
+        recorded = grDevices.recordPlot()
+    finally:
+        grDevices.dev_off()
+    session = runtime.robjects().globalenv[symbol]
+    if 'plots' not in session:
+        session['plots'] = base.new_env()
+    session['plots'][plot_uuid] = base.list(plot=recorded, aspect=aspect, used=time.time())
+    runtime.function('evict_plots', evict_plots_R)(session['plots'], settings.plot_records,
+                                                   time.time() - settings.plot_record_ttl)
+    return return_r
+
+
+def call_function(symbol, func, parameters, plot_uuid, returns):
+    connection = connections(symbol)
+    plan = call_plan(func)
+    function = plan['function']
+    try:
+        if 'servers' in parameters:
+            connection = helpers.extract_connections(connection, parameters['servers'])
+        parameters_used = helpers.plan_parameters(plan, parameters)
+        if 'datasources' in parameters_used:
+            parameters_used['datasources'] = connection
+        start = time.monotonic()
+        if plot_uuid is not None:
+            aspect_mul = 1
+            if (parameters_used['type'] == 'split') | (parameters_used['type'][0] == 'split'):
+                aspect_mul = len(connection)
+            return_r = record_plot(symbol, plot_uuid, function, parameters_used, aspect_mul)
+        else:
+            return_r = function(**parameters_used)
+        consolewrite_status('timings', {'r': time.monotonic() - start})
+        if returns:
+            start = time.monotonic()
+            result = helpers.convert_result(return_r, parameters)
+            consolewrite_status('timings', {'conversion': time.monotonic() - start})
+            return result
+        return None
+    except Exception as err:
+        raise RError(error_string(err))
+
+
+def after_steps(symbol, steps, job, *args):
+    for index, step in enumerate(steps):
+        try:
+            call_function(symbol, step['func'], step['parameters'], None, False)
+        except RError as err:
+            raise RError(f"deferred {step['func']} of {step['parameters'].get('newobj')} failed: {err}")
+        consolewrite_status('materialized', index)
+    return globals()[job](symbol, *args)
+
+
+def catalog(symbol, symbols, listing=True):
+    fetched = {'symbols': {}}
+    if listing:
+        fetched['ds.ls'] = call_function(symbol, 'ds.ls', {}, None, True)
+    for name in symbols:
+        fetched['symbols'][name] = {}
+        for func in helpers.catalog_functions:
+            try:
+                fetched['symbols'][name][func] = call_function(symbol, func, {'x': name}, None, True)
+            except RError:
+                continue
+    return fetched
+
+
+def render_plot(symbol, plot_uuid, plot_format, width, height, res):
+    try:
+        plots = runtime.robjects().globalenv[symbol]['plots']
+        plot = plots[plot_uuid]
+    except LookupError:
+        raise fdrtd.server.exceptions.InvalidIdentifier('plot_uuid', plot_uuid)
+    runtime.function('touch_plot', 'function(plots, name, now) plots[[name]]$used <- now')(plots, plot_uuid,
+                                                                                            time.time())
+    if width is None:
+        width = height * plot.rx2('aspect')[0]
+    handle, filename = tempfile.mkstemp(suffix='.' + plot_format)
+    os.close(handle)
+    try:
+        if plot_format == 'png':
+            grDevices.png(filename=filename, width=width, height=height, units='in', res=res)
+        elif plot_format == 'svg':
+            grDevices.svg(filename=filename, width=width, height=height)
+        else:
+            grDevices.pdf(file=filename, width=width, height=height)
+        try:
+            grDevices.replayPlot(plot.rx2('plot'))
+        finally:
+            grDevices.dev_off()
+        with open(filename, 'rb') as file:
+            return file.read()
+    except Exception as err:
+        raise RError(error_string(err))
+    finally:
+        os.remove(filename)
+
+
+# while it is traced, every DSI::datashield.aggregate reports each server's answer as soon as it arrives through
+# the success and error callbacks of DSI, which polls the asynchronous requests of all servers at once
+trace_aggregate_R = '''function(started, answered) suppressMessages(trace(
+    "datashield.aggregate", where=asNamespace("DSI"), print=FALSE, tracer=bquote({
+        .(started)()
+        if (is.null(success)) success <- function(server, value) .(answered)(server, value, NULL)
+        if (is.null(error)) error <- function(server, message) .(answered)(server, NULL, message)
+    })
+))'''
+untrace_aggregate_R = 'function() suppressMessages(untrace("datashield.aggregate", where=asNamespace("DSI")))'
+
+
+def call_function_per_server(symbol, func, parameters, returns):
+    rounds = []
+    servers = []
+
+    def started():
+        rounds.append(time.monotonic())
+        return rinterface.NULL
+
+    def answered(server, value, error):
+        status = {'server': server[0], 'round': len(rounds), 'latency': time.monotonic() - rounds[-1]}
+        try:
+            if not isinstance(error, type(rinterface.NULL)):
+                status['error'] = '\n'.join(error)
+            elif returns:
+                status['result'] = helpers.convert_result(value, parameters)
+        except Exception as err:
+            status['error'] = str(err)
+        consolewrite_status('servers', status)
+        servers.append(status)
+        return rinterface.NULL
+
+    runtime.function('trace_aggregate', trace_aggregate_R)(rinterface.rternalize(started),
+                                                          rinterface.rternalize(answered))
+    try:
+        result = call_function(symbol, func, parameters, None, returns)
+    finally:
+        runtime.function('untrace_aggregate', untrace_aggregate_R)()
+    return {'servers': servers, 'result': result}
+
+
+def call_batch(symbol, steps, stop_on_error):
+    results = []
+    for index, step in enumerate(steps):
+        try:
+            results.append(call_function(symbol, step['func'], step['parameters'], step['plot_uuid'],
+                                         step['returns']))
+        except RError as err:
+            consolewrite_status('steps', {'index': index, 'function': step['func'], 'error': str(err)})
+            results.append(None)
+            if stop_on_error:
+                break
+            continue
+        consolewrite_status('steps', {'index': index, 'function': step['func']})
+    return results
+
+
+def logout(symbol):
+    try:
+        return_r = DSI.datashield_logout(connections(symbol))
+        if isinstance(return_r, type(rinterface.NULL)):
+            return None
+        return helpers.r_to_json(return_r, False)
+    except Exception as err:
+        raise RError(error_string(err))
+    finally:
+        release_session(symbol)
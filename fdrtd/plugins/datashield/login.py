@@ -1,32 +1,14 @@
+import functools
+import time
 import uuid as _uuid
-from threading import Thread
-import importlib.util
-from pathlib import Path
-
-import rpy2
-import rpy2.rinterface
-import rpy2.rinterface_lib
-from rpy2.robjects.packages import importr
-from rpy2.robjects import r
 
 import fdrtd.server
 from fdrtd.server.microservice import Microservice
-try:
-    from fdrtd.plugins.protocol_DataSHIELD.src import helpers
-except ImportError:
-    spec_helpers = importlib.util.spec_from_file_location('helpers', Path(__file__).resolve().parent / 'helpers.py')
-    helpers = importlib.util.module_from_spec(spec_helpers)
-    spec_helpers.loader.exec_module(helpers)
-
-consolewrite_warnerror_backup = rpy2.rinterface_lib.callbacks.consolewrite_warnerror
-consolewrite_print_backup = rpy2.rinterface_lib.callbacks.consolewrite_print
-
-base = importr('base')
-DSI = importr('DSI')
-DSOpal = importr('DSOpal')
-dsBaseClient = importr('dsBaseClient')
-grDevices = importr('grDevices')
-jsonlite_R = importr('jsonlite')
+from fdrtd.plugins.datashield import settings
+from fdrtd.plugins.datashield.executor import get_deadlines, get_executor
+from fdrtd.plugins.datashield.metrics import Metrics
+from fdrtd.plugins.datashield.sessions import get_session_pool, session_key, session_symbol
+from fdrtd.plugins.datashield.status import StatusBoard
 
 
 class Login(Microservice):
@@ -35,48 +17,182 @@ class Login(Microservice):
         super().__init__(bus, endpoint)
         self.storage = {}
         self.connection_callbacks_storage = {}
+        self.status_board = StatusBoard()
+        self.metrics = Metrics('datashield')
+        if settings.r_warm_up:
+            get_executor().warm_up()
 
     def login(self, list_of_servers, parameters=None, **kwargs):
         if parameters is None:
             parameters = {}
         parameters.update(kwargs)
         uuid = str(_uuid.uuid4())
-        self.storage[uuid] = {'warnerror': [], 'print': [], 'busy': True}
-        Thread(target=self.login_helper, args=(uuid, list_of_servers, parameters), daemon=True).start()
+        for old_uuid in self.status_board.prune(self.storage, settings.status_records, settings.status_ttl):
+            self.connection_callbacks_storage.pop(old_uuid, None)
+        self.storage[uuid] = {'warnerror': [], 'print': [], 'busy': True, 'timings': {'queued': time.time()}}
+        if parameters.get('partial', False):
+            self.storage[uuid]['servers'] = []
+        key = None
+        session_pool = get_session_pool()
+        if session_pool.max_sessions > 0 and parameters.get('reuse_session', True):
+            key = session_key(list_of_servers, parameters)
+            session = session_pool.acquire(key)
+            if session is not None:
+                self.storage[uuid]['reused'] = True
+                helper = functools.partial(self.reuse_helper, uuid, list_of_servers, parameters, key, session)
+                try:
+                    self.submit_helper(uuid, helper, 'ping', session_symbol(session), pin=session)
+                    return self.callback(uuid)
+                except fdrtd.server.exceptions.ApiError as err:
+                    if err.statuscode != 410:
+                        session_pool.release(session)
+                        del self.storage[uuid]
+                        raise
+                    session_pool.discard(session)
+                    self.storage[uuid]['reused'] = False
+        try:
+            self.submit_login(uuid, list_of_servers, parameters, key)
+        except fdrtd.server.exceptions.ApiError:
+            del self.storage[uuid]
+            raise
         return self.callback(uuid)
 
-    def login_helper(self, uuid, list_of_servers, parameters):
-        rpy2.rinterface_lib.callbacks.consolewrite_warnerror = lambda e: self.storage[uuid]['warnerror'].append(e)
-        rpy2.rinterface_lib.callbacks.consolewrite_print = lambda e: self.storage[uuid]['print'].append(e)
-        builder = r('builder%s <- DSI::newDSLoginBuilder()' % uuid.replace('-', ''))
-        for server in list_of_servers:
-            try:
-                builder['append'](**server)
-            except Exception as err:
-                self.storage[uuid]['busy'] = False
-                raise helpers.handle_error(str(err), 'login')
+    def submit_helper(self, uuid, helper, job, *args, pin):
+        future = get_executor().submit(job, *args, console=self.status_board.console(self.storage[uuid]), pin=pin)
+        future.add_done_callback(helper)
+
+    def submit_login(self, uuid, list_of_servers, parameters, key):
+        helper = functools.partial(self.login_helper, uuid, list_of_servers, parameters, key)
+        if parameters.get('partial', False):
+            self.submit_helper(uuid, helper, 'login_servers', uuid, list_of_servers, parameters,
+                               parameters.get('server_timeout', settings.login_server_timeout), pin=uuid)
+        else:
+            self.submit_helper(uuid, helper, 'login', uuid, list_of_servers, parameters, pin=uuid)
+
+    def login_helper(self, uuid, list_of_servers, parameters, key, future):
         try:
-            connection = r('connections%s <- DSI::datashield.login(%s)'
-                           % (uuid.replace('-', ''), helpers.login_params_string_builder(parameters, uuid)))
+            result = future.result()
         except Exception as err:
-            self.storage[uuid]['busy'] = False
-            raise helpers.handle_error(str(err), 'login')
-        self.storage[uuid]['busy'] = False
-        connection_microservice_uuid = self.bus.select_microservice(
+            get_executor().release(uuid)
+            self.fail(uuid, err)
+            return None
+        failed = []
+        if parameters.get('partial', False):
+            failed_names = set(status['server'] for status in result['servers'] if 'error' in status)
+            failed = [server for server in list_of_servers if server.get('server') in failed_names]
+        pooled = key is not None and not failed and get_session_pool().add(key, uuid, parameters)
+        self.prefetch(uuid, uuid, pooled, list_of_servers, parameters)
+        if failed and parameters.get('retry_failed', False):
+            get_deadlines().add(settings.login_retry_interval,
+                                functools.partial(self.retry, uuid, failed, parameters, 1))
+        return None
+
+    def retry(self, uuid, list_of_servers, parameters, attempt):
+        if uuid not in self.storage:
+            return None
+        if uuid not in self.connection_callbacks_storage:
+            get_deadlines().add(settings.login_retry_interval,
+                                functools.partial(self.retry, uuid, list_of_servers, parameters, attempt))
+            return None
+        if not self.bus.call_microservice(handle=self.select_connection_microservice(), function='connected',
+                                          parameters={'uuid': uuid}):
+            return None
+        try:
+            self.submit_helper(uuid, functools.partial(self.retry_helper, uuid, list_of_servers, parameters, attempt),
+                               'login_servers', uuid, list_of_servers, parameters,
+                               parameters.get('server_timeout', settings.login_server_timeout), True, pin=uuid)
+        except fdrtd.server.exceptions.ApiError:
+            self.retry_helper(uuid, list_of_servers, parameters, attempt, None)
+        return None
+
+    def retry_helper(self, uuid, list_of_servers, parameters, attempt, future):
+        try:
+            result = future.result()
+        except Exception:
+            result = {'symbol': uuid, 'servers': []}
+        if result['symbol'] is None:
+            get_executor().release(uuid)
+            return None
+        succeeded = set(status['server'] for status in result['servers'] if 'error' not in status)
+        if succeeded:
+            self.bus.call_microservice(handle=self.select_connection_microservice(), function='refresh',
+                                       parameters={'uuid': uuid})
+        failed = [server for server in list_of_servers if server.get('server') not in succeeded]
+        if failed and attempt < settings.login_retries:
+            get_deadlines().add(settings.login_retry_interval,
+                                functools.partial(self.retry, uuid, failed, parameters, attempt + 1))
+        return None
+
+    def reuse_helper(self, uuid, list_of_servers, parameters, key, session, future):
+        try:
+            future.result()
+        except Exception:
+            get_session_pool().discard(session)
+            self.storage[uuid]['reused'] = False
+            try:
+                self.submit_login(uuid, list_of_servers, parameters, key)
+            except fdrtd.server.exceptions.ApiError as err:
+                self.fail(uuid, err)
+            return None
+        self.prefetch(uuid, session, True, list_of_servers, parameters)
+        return None
+
+    def select_connection_microservice(self):
+        return self.bus.select_microservice(
             requirements={'protocol': 'DataSHIELD', 'microservice': 'connection'}
         )
+
+    def prefetch(self, uuid, session, pooled, list_of_servers, parameters):
+        login = {'servers': list_of_servers, 'parameters': parameters}
+        if parameters.get('catalog', False) and str(parameters.get('assign', False)).upper() == 'TRUE':
+            try:
+                self.submit_helper(uuid, functools.partial(self.catalog_helper, uuid, session, pooled, login),
+                                   'catalog', session_symbol(session), [parameters.get('symbol', 'D')], pin=session)
+                return None
+            except fdrtd.server.exceptions.ApiError as err:
+                self.storage[uuid]['catalog_error'] = str(err)
+        self.connect(uuid, session, pooled, login)
+        return None
+
+    def catalog_helper(self, uuid, session, pooled, login, future):
+        try:
+            catalog = future.result()
+        except Exception as err:
+            self.storage[uuid]['catalog_error'] = str(err)
+            catalog = None
+        self.connect(uuid, session, pooled, login, catalog)
+        return None
+
+    def connect(self, uuid, session, pooled, login, catalog=None):
+        connection = {'session': session, 'symbol': session_symbol(session), 'pooled': pooled, 'login': login}
+        if catalog is not None:
+            connection['catalog'] = catalog
         self.connection_callbacks_storage[uuid] = self.bus.call_microservice(
-            handle=connection_microservice_uuid,
+            handle=self.select_connection_microservice(),
             function='connect',
             parameters={'connection': connection, 'uuid': uuid}
         )
-        return None
+        self.finish(uuid)
+
+    def fail(self, uuid, err):
+        self.storage[uuid]['error'] = str(err)
+        self.finish(uuid)
+
+    def finish(self, uuid):
+        self.status_board.finish(self.storage[uuid])
+        self.metrics.observe_record('login', self.storage[uuid])
+
+    def get_metrics(self):
+        return self.metrics.render()
 
-    def get_status(self, callback):
+    def get_status(self, callback, cursor=None, timeout=0):
         try:
-            return self.storage[callback]
+            record = self.storage[callback]
         except KeyError:
             raise fdrtd.server.exceptions.InvalidParameter(f'uuid {callback}', 'not found')
+        if cursor is None:
+            return record
+        return self.status_board.poll(record, cursor, timeout)
 
     def get_result(self, callback):
         try:
@@ -0,0 +1,86 @@
+from threading import Lock
+
+buckets = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+
+def labels_string(labels, **extra):
+    pairs = list(labels) + sorted(extra.items())
+    if not pairs:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in pairs)
+    return '{%s}' % ','.join(f'{key}="{value}"' for (key, _), value in zip(pairs, escaped))
+
+
+class Metrics:
+
+    def __init__(self, prefix):
+        self.prefix = prefix
+        self.counters = {}
+        self.histograms = {}
+        self.help = {}
+        self.lock = Lock()
+
+    def increment(self, name, help_text, value=1, **labels):
+        with self.lock:
+            self.help[name] = ('counter', help_text)
+            key = (name, tuple(sorted(labels.items())))
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name, help_text, value, **labels):
+        with self.lock:
+            self.help[name] = ('histogram', help_text)
+            key = (name, tuple(sorted(labels.items())))
+            histogram = self.histograms.setdefault(key, {'buckets': [0] * len(buckets), 'sum': 0, 'count': 0})
+            for index, bound in enumerate(buckets):
+                if value <= bound:
+                    histogram['buckets'][index] += 1
+            histogram['sum'] += value
+            histogram['count'] += 1
+
+    def observe_record(self, kind, record, **labels):
+        if 'error' in record:
+            outcome = 'error'
+        elif record.get('cached'):
+            outcome = 'cached'
+        elif record.get('reused'):
+            outcome = 'reused'
+        elif record.get('deferred'):
+            outcome = 'deferred'
+        elif record.get('catalog'):
+            outcome = 'catalog'
+        else:
+            outcome = 'success'
+        self.increment(f'{kind}s_total', f'number of finished {kind}s', outcome=outcome, **labels)
+        timings = record.get('timings', {})
+        for timing, description in (('total', 'from submission to completion'), ('queue', 'waiting for R'),
+                                    ('r', 'in R'), ('conversion', 'converting R results')):
+            if timing in timings:
+                self.observe(f'{kind}_{timing}_seconds', f'seconds spent per {kind} {description}', timings[timing],
+                             **labels)
+        for server in record.get('servers', []):
+            self.increment('server_calls_total', 'number of finished calls per server',
+                           outcome='error' if 'error' in server else 'success', server=server['server'], **labels)
+            self.observe('server_seconds', 'seconds until a server answered a per-server call', server['latency'],
+                         server=server['server'], **labels)
+
+    def render(self):
+        lines = []
+        with self.lock:
+            for name, (kind, help_text) in sorted(self.help.items()):
+                full_name = f'{self.prefix}_{name}'
+                lines.append(f'# HELP {full_name} {help_text}')
+                lines.append(f'# TYPE {full_name} {kind}')
+                if kind == 'counter':
+                    for (counter_name, labels), value in sorted(self.counters.items()):
+                        if counter_name == name:
+                            lines.append(f'{full_name}{labels_string(labels)} {value}')
+                    continue
+                for (histogram_name, labels), histogram in sorted(self.histograms.items()):
+                    if histogram_name != name:
+                        continue
+                    for bound, count in zip(buckets, histogram['buckets']):
+                        lines.append(f'{full_name}_bucket{labels_string(labels, le=bound)} {count}')
+                    lines.append(f'{full_name}_bucket{labels_string(labels, le="+Inf")} {histogram["count"]}')
+                    lines.append(f'{full_name}_sum{labels_string(labels)} {histogram["sum"]}')
+                    lines.append(f'{full_name}_count{labels_string(labels)} {histogram["count"]}')
+        return '\n'.join(lines) + '\n'
@@ -0,0 +1,93 @@
+import os
+import re
+import time
+from threading import Lock
+
+packages = ('base', 'DSI', 'DSOpal', 'dsBaseClient', 'grDevices', 'jsonlite')
+
+loaded = {}
+functions = {}
+timings = {}
+lock = Lock()
+
+
+def robjects():
+    with lock:
+        start = time.monotonic()
+        import rpy2.robjects
+        timings.setdefault('R', time.monotonic() - start)
+    return rpy2.robjects
+
+
+def package(name):
+    if name not in loaded:
+        robjects()
+        with lock:
+            if name not in loaded:
+                from rpy2.robjects.packages import importr
+                start = time.monotonic()
+                loaded[name] = importr(name)
+                timings[name] = time.monotonic() - start
+    return loaded[name]
+
+
+def function(name, code):
+    if name not in functions:
+        evaluated = robjects().r(code)
+        with lock:
+            functions.setdefault(name, evaluated)
+    return functions[name]
+
+
+def library_paths():
+    paths = []
+    for variable in ('R_LIBS', 'R_LIBS_USER', 'R_LIBS_SITE'):
+        paths.extend(path for path in os.environ.get(variable, '').split(os.pathsep) if path)
+    r_home = os.environ.get('R_HOME')
+    if not r_home:
+        from rpy2 import situation
+        r_home = situation.get_r_home()
+    if r_home:
+        paths.extend([os.path.join(r_home, 'site-library'), os.path.join(r_home, 'library')])
+    return paths + ['/usr/local/lib/R/site-library', '/usr/lib/R/site-library', '/usr/lib/R/library']
+
+
+def exports(name):
+    # the exported functions of an installed package, read from its NAMESPACE file without starting R
+    for directory in library_paths():
+        path = os.path.join(directory, name, 'NAMESPACE')
+        if os.path.exists(path):
+            with open(path) as file:
+                namespace = file.read()
+            if 'exportPattern' in namespace:
+                return None
+            return [export.strip().strip('"\'`') for group in re.findall(r'^export\(([^)]*)\)', namespace, re.M)
+                    for export in group.split(',')]
+    return None
+
+
+class LazyPackage:
+
+    def __init__(self, name):
+        self.name = name
+
+    def __getattr__(self, attribute):
+        return getattr(package(self.name), attribute)
+
+
+def interrupt(pending=1):
+    if 'R' not in timings:
+        return None
+    from rpy2.rinterface_lib import openrlib
+    openrlib.rlib.R_interrupts_pending = pending
+
+
+def warm_up():
+    for name in packages:
+        package(name)
+    return get_status()
+
+
+def get_status():
+    with lock:
+        return {'loaded': list(loaded), 'timings': dict(timings)}
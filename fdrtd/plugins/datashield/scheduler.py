@@ -0,0 +1,145 @@
+import functools
+import itertools
+import time
+from concurrent.futures import Future
+from threading import Lock
+
+import fdrtd.server
+from fdrtd.plugins.datashield import settings
+from fdrtd.plugins.datashield.executor import Cancelled, finish_future, get_executor, overloaded
+
+
+class FairScheduler:
+
+    def __init__(self, max_pending, workers, connection_slots, weights):
+        self.max_pending = max_pending
+        self.workers = workers
+        self.connection_slots = connection_slots
+        self.weights = weights
+        self.pending = []
+        self.finish_tags = {}
+        self.active = []
+        self.virtual_time = 0
+        self.counter = itertools.count()
+        self.lock = Lock()
+
+    def submit(self, connection, priority, job, *args, console=None, pin=None):
+        if priority not in self.weights:
+            raise fdrtd.server.exceptions.InvalidParameter('priority', priority)
+        future = Future()
+        with self.lock:
+            if len(self.pending) >= self.max_pending:
+                raise overloaded(self.max_pending)
+            start = max(self.virtual_time, self.finish_tags.get(connection, 0))
+            self.finish_tags[connection] = start + 1 / self.weights[priority]
+            self.pending.append({
+                'future': future, 'job': job, 'args': args, 'console': console, 'pin': pin,
+                'connection': connection, 'priority': priority, 'start': start, 'finish': self.finish_tags[connection],
+                'order': next(self.counter), 'queued': time.monotonic()
+            })
+        self.dispatch()
+        return future
+
+    def dispatch(self):
+        executor = get_executor()
+        while True:
+            with self.lock:
+                free = set(range(self.workers)) - set(item['worker'] for item in self.active)
+                if not free:
+                    return None
+                eligible = []
+                for item in self.heads():
+                    if self.running(item['connection']) < self.connection_slots:
+                        worker = executor.pinned_worker(item['pin'])
+                        if worker in free or worker is None:
+                            eligible.append(item)
+                if not eligible:
+                    return None
+                item = min(eligible, key=lambda item: (item['finish'], item['order']))
+                self.pending.remove(item)
+                self.virtual_time = max(self.virtual_time, item['start'])
+                item['worker'] = executor.pinned_worker(item['pin'])
+                self.active.append(item)
+                self.forget_idle_flows()
+            try:
+                inner = executor.submit(item['job'], *item['args'], console=item['console'], pin=item['pin'],
+                                        among=free)
+            except Exception as err:
+                self.done(item, None)
+                finish_future(item['future'], exception=err)
+                continue
+            with self.lock:
+                item['inner'] = inner
+                item['worker'] = executor.worker_index(inner)
+                reason = item.get('cancelled')
+            if reason is not None:
+                get_executor().cancel(inner, reason)
+            inner.add_done_callback(functools.partial(self.done, item))
+
+    def heads(self):
+        heads = {}
+        for item in self.pending:
+            heads.setdefault(item['connection'], item)
+        return heads.values()
+
+    def running(self, connection):
+        return sum(1 for item in self.active if item['connection'] == connection)
+
+    def forget_idle_flows(self):
+        active = set(item['connection'] for item in self.pending)
+        for flow in [flow for flow, tag in self.finish_tags.items() if flow not in active and tag <= self.virtual_time]:
+            del self.finish_tags[flow]
+
+    def done(self, item, inner):
+        with self.lock:
+            self.active.remove(item)
+        if inner is not None:
+            if inner.exception() is None:
+                finish_future(item['future'], inner.result())
+            else:
+                finish_future(item['future'], exception=inner.exception())
+        self.dispatch()
+
+    def cancel(self, future, reason):
+        with self.lock:
+            item = next((item for item in self.pending if item['future'] is future), None)
+            if item is not None:
+                self.pending.remove(item)
+            else:
+                item = next((item for item in self.active if item['future'] is future), None)
+                if item is None:
+                    return False
+                if 'inner' not in item:
+                    item['cancelled'] = reason
+                    return True
+        if 'inner' not in item:
+            return finish_future(future, exception=Cancelled(reason))
+        return get_executor().cancel(item['inner'], reason)
+
+    def position(self, future):
+        with self.lock:
+            ordered = sorted(self.pending, key=lambda item: (item['finish'], item['order']))
+            for position, item in enumerate(ordered):
+                if item['future'] is future:
+                    return {'position': position, 'priority': item['priority'],
+                            'waiting': time.monotonic() - item['queued']}
+        return None
+
+    def get_status(self):
+        with self.lock:
+            return {'pending': len(self.pending), 'running': len(self.active), 'workers': self.workers,
+                    'connection_slots': self.connection_slots, 'weights': self.weights}
+
+
+scheduler = None
+scheduler_lock = Lock()
+
+
+def get_scheduler():
+    global scheduler
+    with scheduler_lock:
+        if scheduler is None:
+            scheduler = FairScheduler(settings.executor_queue_size, max(settings.worker_processes, 1),
+                                      settings.connection_concurrency,
+                                      {'interactive': settings.interactive_weight, 'batch': settings.batch_weight})
+        return scheduler
@@ -0,0 +1,108 @@
+import hashlib
+import json
+import logging
+import time
+from threading import Lock, Thread
+
+import fdrtd.server
+from fdrtd.plugins.datashield import settings
+from fdrtd.plugins.datashield.executor import get_executor
+
+key_options = ('assign', 'missings', 'symbol', 'id_name', 'id.name', 'restore', 'variables')
+
+
+def session_key(list_of_servers, parameters):
+    options = dict((key, parameters[key]) for key in key_options if key in parameters)
+    return hashlib.sha256(json.dumps([list_of_servers, options], sort_keys=True, default=str).encode()).hexdigest()
+
+
+def session_symbol(session):
+    return 'session%s' % session.replace('-', '')
+
+
+def logout_session(session):
+    try:
+        future = get_executor().submit('logout', session_symbol(session), pin=session)
+    except fdrtd.server.exceptions.ApiError as err:
+        logging.error(f'could not log out of pooled session {session}: {err}')
+        get_executor().release(session)
+        return None
+    future.add_done_callback(lambda _: get_executor().release(session))
+    return None
+
+
+class SessionPool:
+
+    def __init__(self, max_sessions, idle_timeout):
+        self.max_sessions = max_sessions
+        self.idle_timeout = idle_timeout
+        self.sessions = {}
+        self.evictions = 0
+        self.lock = Lock()
+        if max_sessions > 0:
+            Thread(target=self.run, name='datashield-session-pool', daemon=True).start()
+
+    def acquire(self, key):
+        with self.lock:
+            for session, record in self.sessions.items():
+                if record['key'] == key and not record['leased']:
+                    record['leased'] = True
+                    return session
+        return None
+
+    def add(self, key, session, parameters):
+        with self.lock:
+            if len(self.sessions) >= self.max_sessions:
+                self.evict(1)
+            if len(self.sessions) >= self.max_sessions:
+                return False
+            self.sessions[session] = {'key': key, 'parameters': parameters, 'leased': True, 'idle_since': None}
+        return True
+
+    def release(self, session):
+        with self.lock:
+            if session in self.sessions:
+                self.sessions[session].update({'leased': False, 'idle_since': time.monotonic()})
+
+    def discard(self, session):
+        with self.lock:
+            self.sessions.pop(session, None)
+        logout_session(session)
+
+    def pooled(self, session):
+        return session in self.sessions
+
+    def parameters(self, session):
+        return self.sessions[session]['parameters']
+
+    def evict(self, count=None, idle_before=None):
+        idle = sorted((record['idle_since'], session) for session, record in self.sessions.items()
+                      if not record['leased'] and (idle_before is None or record['idle_since'] < idle_before))
+        for _, session in idle[:count]:
+            del self.sessions[session]
+            self.evictions += 1
+            logout_session(session)
+
+    def run(self):
+        while True:
+            time.sleep(min(self.idle_timeout, 60))
+            with self.lock:
+                self.evict(idle_before=time.monotonic() - self.idle_timeout)
+
+    def get_status(self):
+        with self.lock:
+            leased = sum(1 for record in self.sessions.values() if record['leased'])
+            return {'leased': leased, 'idle': len(self.sessions) - leased, 'max_sessions': self.max_sessions,
+                    'evictions': self.evictions}
+
+
+session_pool = None
+session_pool_lock = Lock()
+
+
+def get_session_pool():
+    global session_pool
+    with session_pool_lock:
+        if session_pool is None:
+            session_pool = SessionPool(settings.session_pool_size, settings.session_idle_timeout)
+        return session_pool
@@ -0,0 +1,37 @@
+import os
+import tempfile
+
+executor_queue_size = int(os.environ.get('FDRTD_DATASHIELD_EXECUTOR_QUEUE_SIZE', 256))
+worker_processes = int(os.environ.get('FDRTD_DATASHIELD_WORKER_PROCESSES', 0))
+call_timeout = float(os.environ.get('FDRTD_DATASHIELD_CALL_TIMEOUT', 0))
+connection_max_calls = int(os.environ.get('FDRTD_DATASHIELD_CONNECTION_MAX_CALLS', 16))
+connection_concurrency = int(os.environ.get('FDRTD_DATASHIELD_CONNECTION_CONCURRENCY', 1))
+interactive_weight = float(os.environ.get('FDRTD_DATASHIELD_INTERACTIVE_WEIGHT', 4))
+batch_weight = float(os.environ.get('FDRTD_DATASHIELD_BATCH_WEIGHT', 1))
+r_warm_up = os.environ.get('FDRTD_DATASHIELD_R_WARM_UP', 'false').lower() in ('1', 'true', 'yes')
+status_max_timeout = float(os.environ.get('FDRTD_DATASHIELD_STATUS_MAX_TIMEOUT', 30))
+result_cache_size = int(os.environ.get('FDRTD_DATASHIELD_RESULT_CACHE_SIZE', 0))
+result_cache_ttl = float(os.environ.get('FDRTD_DATASHIELD_RESULT_CACHE_TTL', 300))
+plot_cache_size = int(os.environ.get('FDRTD_DATASHIELD_PLOT_CACHE_SIZE', 32))
+plot_cache_ttl = float(os.environ.get('FDRTD_DATASHIELD_PLOT_CACHE_TTL', 3600))
+plot_records = int(os.environ.get('FDRTD_DATASHIELD_PLOT_RECORDS', 32))
+plot_record_ttl = float(os.environ.get('FDRTD_DATASHIELD_PLOT_RECORD_TTL', 3600))
+plot_preview_res = int(os.environ.get('FDRTD_DATASHIELD_PLOT_PREVIEW_RES', 48))
+login_server_timeout = float(os.environ.get('FDRTD_DATASHIELD_LOGIN_SERVER_TIMEOUT', 15))
+login_retries = int(os.environ.get('FDRTD_DATASHIELD_LOGIN_RETRIES', 3))
+login_retry_interval = float(os.environ.get('FDRTD_DATASHIELD_LOGIN_RETRY_INTERVAL', 60))
+session_pool_size = int(os.environ.get('FDRTD_DATASHIELD_SESSION_POOL_SIZE', 0))
+session_idle_timeout = float(os.environ.get('FDRTD_DATASHIELD_SESSION_IDLE_TIMEOUT', 600))
+result_store_memory = int(os.environ.get('FDRTD_DATASHIELD_RESULT_STORE_MEMORY', 256 * 2 ** 20))
+result_store_ttl = float(os.environ.get('FDRTD_DATASHIELD_RESULT_STORE_TTL', 3600))
+result_store_spill_threshold = int(os.environ.get('FDRTD_DATASHIELD_RESULT_STORE_SPILL_THRESHOLD', 2 ** 20))
+result_store_spill_path = os.environ.get(
+    'FDRTD_DATASHIELD_RESULT_STORE_SPILL_PATH',
+    os.path.join(tempfile.gettempdir(), f'fdrtd-datashield-{os.getpid()}.sqlite')
+)
+result_store_chunk_items = int(os.environ.get('FDRTD_DATASHIELD_RESULT_STORE_CHUNK_ITEMS', 1000))
+snapshot_path = os.environ.get('FDRTD_DATASHIELD_SNAPSHOT_PATH', '')
+snapshot_ttl = float(os.environ.get('FDRTD_DATASHIELD_SNAPSHOT_TTL', 86400))
+snapshot_timeout = float(os.environ.get('FDRTD_DATASHIELD_SNAPSHOT_TIMEOUT', 60))
+status_records = int(os.environ.get('FDRTD_DATASHIELD_STATUS_RECORDS', 1000))
+status_ttl = float(os.environ.get('FDRTD_DATASHIELD_STATUS_TTL', 3600))
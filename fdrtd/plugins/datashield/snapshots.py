@@ -0,0 +1,83 @@
+import atexit
+import functools
+import importlib
+import json
+import logging
+import os
+import signal
+import threading
+import time
+
+credential_fields = ('password', 'token')
+
+
+def workspace_name(connection_uuid):
+    return 'fdrtd_%s' % connection_uuid.replace('-', '')
+
+
+def load_manifest(path, ttl):
+    if not path or not os.path.exists(path):
+        return {}
+    try:
+        with open(path) as file:
+            manifest = json.load(file)
+    except (OSError, ValueError) as err:
+        logging.error(f'could not read session snapshot {path}: {err}')
+        return {}
+    expired = time.time() - ttl
+    entries = dict((uuid, entry) for uuid, entry in manifest.get('connections', {}).items()
+                   if entry['saved'] >= expired)
+    for entry in entries.values():
+        if 'credentials' not in entry:
+            entry['credentials'] = credential_servers(entry['servers'])
+            entry['servers'] = strip_credentials(entry['servers'])
+    return entries
+
+
+def write_manifest(path, entries):
+    temporary = path + '.tmp'
+    descriptor = os.open(temporary, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(descriptor, 'w') as file:
+        json.dump({'created': time.time(), 'connections': entries}, file, default=str)
+    os.replace(temporary, path)
+
+
+def strip_credentials(servers):
+    return [dict((key, value) for key, value in server.items() if key not in credential_fields) for server in servers]
+
+
+def credential_servers(servers):
+    return [server.get('server') for server in servers if any(key in server for key in credential_fields)]
+
+
+def missing_credentials(entry, list_of_servers):
+    supplied = dict((server.get('server'), server) for server in list_of_servers)
+    return [name for name in entry.get('credentials', [])
+            if not any(key in supplied.get(name, {}) for key in credential_fields)]
+
+
+def add_credentials(servers, list_of_servers):
+    supplied = dict((server.get('server'), server) for server in list_of_servers)
+    merged = []
+    for server in servers:
+        credentials = supplied.get(server.get('server'), {})
+        merged.append(dict(server, **dict((key, credentials[key]) for key in credential_fields if key in credentials)))
+    return merged
+
+
+def on_shutdown(callback):
+    # atexit runs the handlers last in, first out; importing multiprocessing.util registers the one that
+    # terminates the R worker processes, so it has to come before the snapshot
+    importlib.import_module('multiprocessing.util')
+    atexit.register(callback)
+    if threading.current_thread() is threading.main_thread():
+        signal.signal(signal.SIGTERM, functools.partial(terminate, callback, signal.getsignal(signal.SIGTERM)))
+
+
+def terminate(callback, previous, signum, frame):
+    callback()
+    if callable(previous):
+        return previous(signum, frame)
+    if previous == signal.SIG_IGN:
+        return None
+    raise SystemExit(128 + signum)
@@ -0,0 +1,76 @@
+import functools
+import time
+from threading import Condition
+
+from fdrtd.plugins.datashield import settings
+
+streams = ('warnerror', 'print', 'steps', 'servers')
+timestamps = ('queued', 'started', 'finished')
+
+
+class StatusBoard:
+
+    def __init__(self):
+        self.changed = Condition()
+
+    def console(self, record):
+        return functools.partial(self.write, record)
+
+    def write(self, record, stream, text):
+        with self.changed:
+            if stream == 'timings':
+                for key, value in text.items():
+                    if key in timestamps:
+                        record['timings'].setdefault(key, value)
+                    else:
+                        record['timings'][key] = record['timings'].get(key, 0) + value
+            else:
+                record[stream].append(text)
+            self.changed.notify_all()
+
+    def notify(self):
+        with self.changed:
+            self.changed.notify_all()
+
+    def finish(self, record):
+        with self.changed:
+            record['busy'] = False
+            record['finished'] = time.time()
+            timings = record.setdefault('timings', {})
+            timings['finished'] = record['finished']
+            if 'queued' in timings:
+                timings['total'] = timings['finished'] - timings['queued']
+                if 'started' in timings:
+                    timings['queue'] = timings['started'] - timings['queued']
+            self.changed.notify_all()
+
+    @staticmethod
+    def prune(records, max_records, ttl):
+        finished = [(record['finished'], key) for key, record in list(records.items())
+                    if not record['busy'] and 'finished' in record]
+        finished.sort()
+        expired = time.time() - ttl
+        excess = len(records) - max_records
+        pruned = []
+        for count, (finished_at, key) in enumerate(finished):
+            if finished_at >= expired and count >= excess:
+                break
+            del records[key]
+            pruned.append(key)
+        return pruned
+
+    def poll(self, record, cursor, timeout=0):
+        record_streams = [stream for stream in streams if stream in record]
+        cursor = {stream: int(cursor.get(stream, 0)) for stream in record_streams}
+        deadline = time.monotonic() + min(float(timeout), settings.status_max_timeout)
+        with self.changed:
+            while record['busy'] and all(len(record[stream]) <= cursor[stream] for stream in record_streams):
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self.changed.wait(remaining)
+            update = dict((key, value) for key, value in record.items() if key not in streams)
+            for stream in record_streams:
+                update[stream] = record[stream][cursor[stream]:]
+            update['cursor'] = dict((stream, len(record[stream])) for stream in record_streams)
+        return update
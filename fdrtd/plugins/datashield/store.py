@@ -0,0 +1,203 @@
+import atexit
+import os
+import pickle
+import sqlite3
+import time
+from collections import OrderedDict
+from threading import Lock
+
+
+def items(value):
+    if isinstance(value, dict):
+        return 'dict', list(value.items())
+    if isinstance(value, list):
+        return 'list', value
+    return 'value', [value]
+
+
+def assemble(kind, chunk):
+    if kind == 'dict':
+        return dict(chunk)
+    if kind == 'list':
+        return list(chunk)
+    return chunk[0]
+
+
+def estimate_size(value, samples=16):
+    if isinstance(value, (str, bytes)):
+        return len(value)
+    if hasattr(value, 'nbytes'):
+        return value.nbytes
+    if isinstance(value, dict):
+        value = list(value.items())
+    if isinstance(value, (list, tuple)):
+        if not value:
+            return 8
+        step = max(len(value) // samples, 1)
+        sample = value[::step][:samples]
+        return 8 + len(value) * sum(estimate_size(element, samples) for element in sample) // len(sample)
+    return 8
+
+
+def describe(value):
+    metadata = {'type': type(value).__name__}
+    if isinstance(value, dict):
+        metadata.update({'length': len(value), 'keys': list(value)})
+        if value.get('type') == 'data.frame':
+            metadata.update({'shape': [value['nrow'], len(value['columns'])], 'columns': value.get('names')})
+        elif value.get('type') == 'matrix':
+            metadata.update({'shape': value['shape'], 'columns': (value.get('dimnames') or [None, None])[1]})
+    elif isinstance(value, list):
+        metadata['length'] = len(value)
+        if value and all(isinstance(row, list) for row in value) and len(set(len(row) for row in value)) == 1:
+            metadata['shape'] = [len(value), len(value[0])]
+        elif value and isinstance(value[0], dict):
+            metadata['columns'] = list(value[0])
+    return metadata
+
+
+class ResultStore:
+
+    def __init__(self, memory_budget, ttl, spill_threshold, spill_path, chunk_items):
+        self.memory_budget = memory_budget
+        self.ttl = ttl
+        self.spill_threshold = spill_threshold
+        self.spill_path = spill_path
+        self.chunk_items = chunk_items
+        self.entries = OrderedDict()
+        self.memory = 0
+        self.disk = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.database = None
+        self.lock = Lock()
+
+    def spill_database(self):
+        if self.database is None:
+            if os.path.exists(self.spill_path):
+                os.remove(self.spill_path)
+            self.database = sqlite3.connect(self.spill_path, check_same_thread=False)
+            self.database.execute(
+                'CREATE TABLE results (key TEXT, chunk INTEGER, value BLOB, PRIMARY KEY (key, chunk))'
+            )
+            atexit.register(self.close)
+        return self.database
+
+    def close(self):
+        with self.lock:
+            if self.database is not None:
+                self.database.close()
+                self.database = None
+                os.remove(self.spill_path)
+
+    def chunks(self, value):
+        kind, value_items = items(value)
+        return kind, len(value_items), [
+            pickle.dumps(value_items[start:start + self.chunk_items], protocol=pickle.HIGHEST_PROTOCOL)
+            for start in range(0, max(len(value_items), 1), self.chunk_items)
+        ]
+
+    def put(self, key, value):
+        kind, value_items = items(value)
+        metadata = describe(value)
+        metadata['bytes'] = estimate_size(value)
+        with self.lock:
+            self.remove(key)
+            entry = {'value': value, 'kind': kind, 'length': len(value_items), 'metadata': metadata,
+                     'size': metadata['bytes'], 'expires': time.monotonic() + self.ttl, 'spilled': False}
+            self.entries[key] = entry
+            if self.spill_path and entry['size'] > self.spill_threshold:
+                self.spill(key, entry, self.chunks(value)[2])
+            else:
+                self.memory += entry['size']
+            self.expire()
+            for old_key, old_entry in list(self.entries.items()):
+                if self.memory <= self.memory_budget:
+                    break
+                if old_entry['spilled']:
+                    continue
+                self.memory -= old_entry['size']
+                if self.spill_path:
+                    self.spill(old_key, old_entry, self.chunks(old_entry['value'])[2])
+                else:
+                    del self.entries[old_key]
+                    self.evictions += 1
+
+    def spill(self, key, entry, chunks):
+        self.spill_database().executemany('INSERT OR REPLACE INTO results VALUES (?, ?, ?)',
+                                          [(repr(key), index, chunk) for index, chunk in enumerate(chunks)])
+        entry.update({'value': None, 'spilled': True})
+        self.disk += entry['size']
+
+    def entry(self, key):
+        entry = self.entries[key]
+        if entry['expires'] < time.monotonic():
+            self.remove(key)
+            self.expirations += 1
+            raise KeyError(key)
+        self.entries.move_to_end(key)
+        return entry
+
+    def read_items(self, key, start, stop):
+        rows = self.database.execute(
+            'SELECT value FROM results WHERE key = ? AND chunk BETWEEN ? AND ? ORDER BY chunk',
+            (repr(key), start // self.chunk_items, max(stop - 1, 0) // self.chunk_items)
+        )
+        value_items = [item for row in rows for item in pickle.loads(row[0])]
+        offset = start - start % self.chunk_items
+        return value_items[start - offset:stop - offset]
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entry(key)
+            if not entry['spilled']:
+                return entry['value']
+            return assemble(entry['kind'], self.read_items(key, 0, entry['length']))
+
+    def get_page(self, key, offset, limit):
+        with self.lock:
+            entry = self.entry(key)
+            stop = entry['length'] if limit is None else min(offset + limit, entry['length'])
+            if entry['kind'] == 'value':
+                offset, stop = 0, 1
+            if not entry['spilled']:
+                page = items(entry['value'])[1][offset:stop]
+            else:
+                page = self.read_items(key, offset, stop)
+            return {'offset': offset, 'limit': limit, 'total': entry['length'], 'value': assemble(entry['kind'], page)}
+
+    def get_metadata(self, key):
+        with self.lock:
+            return dict(self.entry(key)['metadata'])
+
+    def remove(self, key):
+        entry = self.entries.pop(key, None)
+        if entry is None:
+            return None
+        if entry['spilled']:
+            self.database.execute('DELETE FROM results WHERE key = ?', (repr(key),))
+            self.disk -= entry['size']
+        else:
+            self.memory -= entry['size']
+        return None
+
+    def expire(self):
+        now = time.monotonic()
+        for key in [key for key, entry in self.entries.items() if entry['expires'] < now]:
+            self.remove(key)
+            self.expirations += 1
+
+    def __contains__(self, key):
+        return key in self.entries
+
+    def get_status(self):
+        with self.lock:
+            return {
+                'entries': len(self.entries),
+                'spilled': sum(1 for entry in self.entries.values() if entry['spilled']),
+                'memory': self.memory,
+                'memory_budget': self.memory_budget,
+                'disk': self.disk,
+                'evictions': self.evictions,
+                'expirations': self.expirations
+            }
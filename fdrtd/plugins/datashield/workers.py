@@ -0,0 +1,214 @@
+import itertools
+import logging
+import multiprocessing
+import signal
+import time
+from concurrent.futures import Future
+from threading import Lock, Thread
+
+import fdrtd.server
+from fdrtd.plugins.datashield.executor import Cancelled, finish_future, log_warm_up, overloaded, track_first_call
+
+
+def watch_cancellations(cancel_pipe, running, lock):
+    from fdrtd.plugins.datashield import runtime
+    while True:
+        try:
+            job_id = cancel_pipe.recv()
+        except (EOFError, OSError):
+            return
+        with lock:
+            if job_id == running['job_id']:
+                runtime.interrupt()
+
+
+def worker_main(pipe, cancel_pipe):
+    import rpy2.rinterface_lib.callbacks as callbacks
+    from fdrtd.plugins.datashield import jobs, runtime
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    running = {'job_id': None}
+    lock = Lock()
+    Thread(target=watch_cancellations, args=(cancel_pipe, running, lock), name='datashield-R-worker-cancel',
+           daemon=True).start()
+    while True:
+        try:
+            job_id, job, args = pipe.recv()
+        except EOFError:
+            return
+        with lock:
+            running['job_id'] = job_id
+        callbacks.consolewrite_warnerror = lambda e, job_id=job_id: pipe.send(('console', job_id, 'warnerror', e))
+        callbacks.consolewrite_print = lambda e, job_id=job_id: pipe.send(('console', job_id, 'print', e))
+        jobs.consolewrite_status = lambda stream, s, job_id=job_id: pipe.send(('console', job_id, stream, s))
+        pipe.send(('console', job_id, 'timings', {'started': time.time()}))
+        try:
+            pipe.send(('result', job_id, getattr(jobs, job)(*args)))
+        except fdrtd.server.exceptions.ApiError as err:
+            pipe.send(('error', job_id, err.statuscode, err.message))
+        except (Exception, KeyboardInterrupt) as err:
+            pipe.send(('error', job_id, None, str(err)))
+        finally:
+            with lock:
+                running['job_id'] = None
+                runtime.interrupt(0)
+
+
+def rebuild_error(statuscode, message):
+    if statuscode is None:
+        from fdrtd.plugins.datashield.jobs import RError
+        return RError(message)
+    return fdrtd.server.exceptions.ApiError(statuscode, message)
+
+
+class RWorker:
+
+    def __init__(self, index):
+        self.index = index
+        self.generation = 0
+        self.lock = Lock()
+        self.pending = {}
+        self.cancelled = set()
+        self.running = None
+        self.start()
+
+    def start(self):
+        context = multiprocessing.get_context('spawn')
+        pipe, child_pipe = context.Pipe()
+        child_cancel_pipe, self.cancel_pipe = context.Pipe(duplex=False)
+        self.process = context.Process(target=worker_main, args=(child_pipe, child_cancel_pipe), daemon=True,
+                                       name=f'datashield-R-worker-{self.index}')
+        self.process.start()
+        child_pipe.close()
+        child_cancel_pipe.close()
+        self.pipe = pipe
+        Thread(target=self.read, args=(pipe,), name=f'datashield-R-worker-{self.index}-reader', daemon=True).start()
+
+    def submit(self, job_id, job, args, future, console):
+        with self.lock:
+            self.pending[job_id] = (future, console)
+            try:
+                self.pipe.send((job_id, job, args))
+            except OSError:
+                pass
+
+    def cancel(self, job_id, reason):
+        with self.lock:
+            if job_id not in self.pending or not finish_future(self.pending[job_id][0], exception=Cancelled(reason)):
+                return False
+            self.cancelled.add(job_id)
+            if job_id == self.running:
+                self.interrupt(job_id)
+        return True
+
+    def interrupt(self, job_id):
+        try:
+            self.cancel_pipe.send(job_id)
+        except OSError:
+            pass
+
+    def read(self, pipe):
+        while True:
+            try:
+                message = pipe.recv()
+            except (EOFError, OSError):
+                break
+            kind, job_id = message[:2]
+            future, console = self.pending[job_id]
+            if kind == 'console':
+                if message[2] == 'timings' and 'started' in message[3]:
+                    with self.lock:
+                        self.running = job_id
+                        if job_id in self.cancelled:
+                            self.interrupt(job_id)
+                if console is not None:
+                    console(message[2], message[3])
+                continue
+            with self.lock:
+                del self.pending[job_id]
+                self.cancelled.discard(job_id)
+                self.running = None
+            if kind == 'result':
+                finish_future(future, message[2])
+            else:
+                finish_future(future, exception=rebuild_error(message[2], message[3]))
+        self.restart(pipe)
+
+    def restart(self, pipe):
+        with self.lock:
+            if pipe is not self.pipe:
+                return
+            logging.error(f'R worker {self.index} (pid {self.process.pid}) died, restarting it')
+            pending = self.pending
+            self.pending = {}
+            self.cancelled = set()
+            self.running = None
+            self.generation += 1
+            self.process.join(timeout=1)
+            self.start()
+        for future, _ in pending.values():
+            finish_future(future, exception=fdrtd.server.exceptions.InternalServerError('R worker process died'))
+
+    def get_status(self):
+        return {'pid': self.process.pid, 'alive': self.process.is_alive(), 'generation': self.generation,
+                'queued': len(self.pending)}
+
+
+class RWorkerPool:
+
+    def __init__(self, size, max_queue_size):
+        self.max_queue_size = max_queue_size
+        self.workers = [RWorker(index) for index in range(size)]
+        self.pins = {}
+        self.job_ids = itertools.count()
+        self.first_calls = {}
+        self.lock = Lock()
+
+    def least_loaded(self, among=None):
+        return min((worker for worker in self.workers if among is None or worker.index in among),
+                   key=lambda worker: len(worker.pending))
+
+    def submit(self, job, *args, console=None, pin=None, among=None):
+        with self.lock:
+            if sum(len(worker.pending) for worker in self.workers) >= self.max_queue_size:
+                raise overloaded(self.max_queue_size)
+            if pin is None:
+                worker = self.least_loaded(among)
+            else:
+                if pin not in self.pins:
+                    worker = self.least_loaded(among)
+                    self.pins[pin] = (worker, worker.generation)
+                worker, generation = self.pins[pin]
+                if generation != worker.generation:
+                    raise fdrtd.server.exceptions.ApiError(410, f'session {pin} was lost when its R worker died, '
+                                                                f'please log in again')
+            future = Future()
+            future.set_running_or_notify_cancel()
+            future.worker_job = (worker, next(self.job_ids))
+            worker.submit(future.worker_job[1], job, args, future, console)
+        track_first_call(self.first_calls, job, future)
+        return future
+
+    def release(self, pin):
+        with self.lock:
+            self.pins.pop(pin, None)
+
+    def pinned_worker(self, pin):
+        with self.lock:
+            if pin not in self.pins:
+                return None
+            return self.pins[pin][0].index
+
+    def worker_index(self, future):
+        return future.worker_job[0].index
+
+    def cancel(self, future, reason):
+        worker, job_id = future.worker_job
+        return worker.cancel(job_id, reason)
+
+    def warm_up(self):
+        for _ in self.workers:
+            self.submit('warm_up').add_done_callback(log_warm_up)
+
+    def get_status(self):
+        return {'workers': [worker.get_status() for worker in self.workers], 'sessions': len(self.pins),
+                'max_queue_size': self.max_queue_size, 'first_calls': self.first_calls}
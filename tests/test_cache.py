@@ -0,0 +1,28 @@
+from fdrtd.plugins.datashield.cache import ResultCache
+
+
+def test_put_after_invalidation_is_dropped():
+    cache = ResultCache(10, 60)
+    key = cache.key('a', 'ds.mean', {'x': 'D$x'})
+    assert cache.get(key) == (False, None)
+    generation = cache.generation('a')
+    cache.invalidate('a')
+    cache.put(key, generation, 1)
+    assert cache.get(key) == (False, None)
+    cache.put(key, cache.generation('a'), 2)
+    assert cache.get(key) == (True, 2)
+
+
+def test_forget():
+    cache = ResultCache(10, 60)
+    key = cache.key('a', 'ds.mean', {'x': 'D$x'})
+    cache.get(key)
+    generation = cache.generation('a')
+    cache.put(key, generation, 1)
+    cache.invalidate('a')
+    cache.forget('a')
+    assert cache.entries == {} and cache.generations == {} and cache.counters == {}
+    cache.put(key, generation, 1)
+    assert cache.entries == {}
+    assert cache.get_status('a')['hits'] == 0
+    assert cache.counters == {}
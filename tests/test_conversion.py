@@ -0,0 +1,106 @@
+import os
+import subprocess
+import sys
+
+import pytest
+
+pytest.importorskip('rpy2')
+robjects = pytest.importorskip('rpy2.robjects')
+
+from fdrtd.plugins.datashield import helpers  # noqa: E402
+
+if not robjects.r('requireNamespace("jsonlite", quietly=TRUE)')[0]:
+    pytest.skip('the R package jsonlite is not installed', allow_module_level=True)
+
+# R objects whose native conversion has to match serializeJSON followed by first_sweep and second_sweep;
+# doubles are chosen to have at most 5 decimals, which serializeJSON keeps exactly
+same_output = {
+    'NULL': 'NULL',
+    'integer scalar': '7L',
+    'integer vector': '1:5',
+    'double vector': 'c(1.5, -2.25, 1e3)',
+    'character vector': 'c("a", "b")',
+    'logical vector': 'c(TRUE, FALSE)',
+    'integer NA': 'c(1L, NA)',
+    'double NA': 'c(1.5, NA)',
+    'named scalar': 'c(a=1.5)',
+    'named vector': 'c(a=1.5, b=2)',
+    'factor': 'factor(c("x", "y", "x"))',
+    'unnamed list': 'list(1.5, "a")',
+    'single element list': 'list(list(a=1L))',
+    'named list': 'list(a=1.5, b="x", c=list(d=TRUE, e=1:3))',
+    'matrix': 'matrix(c(1.5, 2, 3, 4), 2)',
+    'matrix with dimnames': 'matrix(c(1.5, 2, 3, 4, 5, 6), 2, dimnames=list(c("r1", "r2"), c("c1", "c2", "c3")))',
+    'one row matrix with dimnames': 'matrix(c(1.5, 2), 1, dimnames=list("r1", c("c1", "c2")))',
+    'table with named dimnames': 'table(x=c("a", "b", "a"), y=c("u", "v", "v"))',
+    'data.frame': 'data.frame(x=c(1.5, 2), y=c("a", "b"), stringsAsFactors=FALSE)',
+    'data.frame with row names': 'data.frame(x=c(1.5, 2), y=c(3, 4), row.names=c("r1", "r2"))',
+    'logarithm': 'structure(2, logarithm=TRUE)',
+    'no logarithm': 'structure(2, logarithm=FALSE)',
+    'determinant': 'determinant(diag(c(2, 3)), logarithm=FALSE)',
+    'nested summary': 'list(study1=list(mean=1.5, n=10L, quantiles=c(`5%`=0.5, `50%`=1.5)), '
+                      'study2=list(mean=2.25, n=20L, quantiles=c(`5%`=1, `50%`=2)))'
+}
+
+
+@pytest.mark.parametrize('code', list(same_output.values()), ids=list(same_output))
+def test_native_matches_serialize_json(code):
+    output = robjects.r(code)
+    assert helpers.r_to_python(output) == helpers.r_to_json(output, False, via_json=True)
+
+
+def test_default_conversion_is_native():
+    output = robjects.r('1 / 3')
+    assert helpers.r_to_json(output, False) == helpers.r_to_python(output)
+
+
+def test_serialize_json_rounds_to_5_digits():
+    output = robjects.r('c(1 / 3, 2 / 3)')
+    assert helpers.r_to_json(output, False, via_json=True) == [0.33333, 0.66667]
+    assert helpers.r_to_python(output) == [1 / 3, 2 / 3]
+
+
+def test_serialize_json_rounds_logarithms():
+    output = robjects.r('determinant(matrix(c(2, 1, 1, 3), 2))$modulus')
+    assert helpers.r_to_json(output, False, via_json=True) == pytest.approx(5, rel=1e-5)
+    assert helpers.r_to_python(output) == pytest.approx(5, rel=1e-12)
+
+
+@pytest.mark.parametrize('code, expected', [
+    ('c(1L, NA)', [1, 'NA']),
+    ('c(1.5, NA)', [1.5, 'NA']),
+    ('c(TRUE, NA)', [True, 'NA']),
+    ('c("a", NA)', ['a', 'NA']),
+    ('NA_character_', 'NA'),
+    ('c(a=NA, b=2L)', {'a': 'NA', 'b': 2})
+])
+def test_native_na(code, expected):
+    # serializeJSON writes logical and character NA as null, which first_sweep turns into False and 'None';
+    # the native converter writes every NA as 'NA'
+    assert helpers.r_to_python(robjects.r(code)) == expected
+
+
+def test_native_nan_is_not_na():
+    result = helpers.r_to_python(robjects.r('c(NaN, NA, 1)'))
+    assert result[0] != result[0]
+    assert result[1:] == ['NA', 1.0]
+
+
+def test_serial_json_is_unchanged():
+    output = robjects.r('list(a=1:3)')
+    assert helpers.r_to_json(output, True) == helpers.jsonlite_R.serializeJSON(output)[0]
+
+
+def test_na_when_helpers_is_imported_before_r_starts():
+    # importing rpy2.robjects above has started R in this process, so the check runs in a fresh interpreter
+    code = """
+from fdrtd.plugins.datashield import helpers
+from rpy2 import robjects
+assert helpers.r_to_python(robjects.r('c(1L, NA)')) == [1, 'NA']
+assert helpers.r_to_python(robjects.r('c(TRUE, NA)')) == [True, 'NA']
+assert helpers.r_to_python(robjects.r('c("a", NA)')) == ['a', 'NA']
+assert helpers.column_buffer(robjects.r('c("a", NA)'), robjects.r('"a"').typeof)['data'] == ['a', None]
+"""
+    environment = dict(os.environ, PYTHONPATH=os.pathsep.join(sys.path))
+    finished = subprocess.run([sys.executable, '-c', code], env=environment, capture_output=True, text=True)
+    assert finished.returncode == 0, finished.stderr
@@ -0,0 +1,171 @@
+from fdrtd.plugins.datashield.deferred import AssignmentGraph, atomic, symbols
+
+
+def defer(graph, func, **matched):
+    return graph.defer(func, matched, dict(matched))
+
+
+def expression(graph, output):
+    return graph.nodes[output]['step']['parameters']['toAssign']
+
+
+def test_symbols():
+    assert symbols('log(D$LAB_HDL, 2) + x.1') == {'D', 'x.1'}
+    assert symbols('c("a", \'b\', y)') == {'y'}
+    assert symbols('TRUE & is.na(NA) | NULL') == set()
+    assert symbols({'x': 'a', 'y': ['b', 'c+d'], 'z': 1}) == {'a', 'b', 'c', 'd'}
+
+
+def test_atomic():
+    assert atomic('D$LAB_HDL')
+    assert atomic('log(D$LAB_HDL)')
+    assert not atomic('log(a) + 1')
+    assert not atomic('a + 1')
+    assert not atomic('paste("a")')
+
+
+def test_defer_builds_assign_step():
+    graph = AssignmentGraph()
+    assert defer(graph, 'ds.log', x='D$LAB_HDL', newobj='hdl')
+    assert graph.nodes['hdl']['step'] == {'func': 'ds.assign',
+                                          'parameters': {'toAssign': 'log(D$LAB_HDL)', 'newobj': 'hdl'}}
+    assert graph.nodes['hdl']['inputs'] == {'D'}
+
+
+def test_defer_refuses():
+    graph = AssignmentGraph()
+    assert not defer(graph, 'ds.mean', x='D$LAB_HDL')
+    assert not defer(graph, 'ds.log', x='D$LAB_HDL')
+    assert not defer(graph, 'ds.log', x='D$LAB_HDL', newobj='hdl', datasources='x')
+    assert not graph.defer('ds.log', {'x': 'a', 'newobj': 'b'}, {'x': 'a', 'newobj': 'b', 'servers': ['s']})
+    assert graph.nodes == {}
+
+
+def test_defer_refuses_to_overwrite_an_input_of_a_pending_node():
+    graph = AssignmentGraph()
+    assert defer(graph, 'ds.log', x='a', newobj='b')
+    assert not defer(graph, 'ds.exp', x='c', newobj='a')
+
+
+def test_fuse():
+    graph = AssignmentGraph()
+    assert defer(graph, 'ds.log', x='D$LAB_HDL', newobj='a')
+    assert defer(graph, 'ds.exp', x='a', newobj='b')
+    assert expression(graph, 'b') == 'exp(log(D$LAB_HDL))'
+    assert graph.nodes['b']['inputs'] == {'D'}
+    assert graph.fused == 1
+
+
+def test_no_fusion_of_compound_expressions():
+    graph = AssignmentGraph()
+    assert defer(graph, 'ds.assign', toAssign='a + 1', newobj='b')
+    assert defer(graph, 'ds.exp', x='b', newobj='c')
+    assert expression(graph, 'c') == 'exp(b)'
+    assert graph.nodes['c']['inputs'] == {'b'}
+    assert graph.materialize() == ['b', 'c']
+
+
+def test_self_reference():
+    graph = AssignmentGraph()
+    assert defer(graph, 'ds.assign', toAssign='x + 1', newobj='x')
+    assert graph.nodes['x']['inputs'] == set()
+    assert graph.materialize() == ['x']
+    assert graph.read('x') == ['x']
+
+
+def test_self_reference_of_a_pending_node():
+    graph = AssignmentGraph()
+    assert defer(graph, 'ds.assign', toAssign='y + 1', newobj='x')
+    assert not defer(graph, 'ds.assign', toAssign='x * 2', newobj='x')
+    assert expression(graph, 'x') == 'y + 1'
+
+
+def test_self_reference_after_fusion():
+    graph = AssignmentGraph()
+    assert defer(graph, 'ds.log', x='y', newobj='x')
+    assert defer(graph, 'ds.exp', x='x', newobj='x')
+    assert expression(graph, 'x') == 'exp(log(y))'
+    assert graph.dropped == 1
+
+
+def test_materialize_order():
+    graph = AssignmentGraph()
+    assert defer(graph, 'ds.assign', toAssign='D$x + 1', newobj='c')
+    assert defer(graph, 'ds.assign', toAssign='c * 2', newobj='a')
+    assert defer(graph, 'ds.assign', toAssign='c + a', newobj='b')
+    assert graph.materialize() == ['c', 'a', 'b']
+    assert graph.materialize({'b'}) == ['c', 'a', 'b']
+    assert graph.materialize({'a', 'c'}) == ['c', 'a']
+
+
+def test_read_materializes_only_what_is_needed():
+    graph = AssignmentGraph()
+    assert defer(graph, 'ds.assign', toAssign='D$x + 1', newobj='a')
+    assert defer(graph, 'ds.assign', toAssign='a * 2', newobj='b')
+    assert defer(graph, 'ds.assign', toAssign='D$y + 1', newobj='c')
+    assert graph.read({'x': 'b'}) == ['a', 'b']
+    assert graph.read({'x': 'D$z'}) == []
+
+
+def test_dead_assignment_is_dropped():
+    graph = AssignmentGraph()
+    assert defer(graph, 'ds.assign', toAssign='D$x + 1', newobj='a')
+    assert defer(graph, 'ds.assign', toAssign='D$y + 1', newobj='a')
+    assert graph.dropped == 1
+    assert graph.steps(graph.send(graph.materialize())) == [
+        {'func': 'ds.assign', 'parameters': {'toAssign': 'D$y + 1', 'newobj': 'a'}}
+    ]
+
+
+def test_dependents():
+    graph = AssignmentGraph()
+    assert defer(graph, 'ds.assign', toAssign='D$x + 1', newobj='a')
+    assert defer(graph, 'ds.assign', toAssign='a * 2', newobj='b')
+    assert graph.dependents('a') == ['b']
+    assert graph.dependents('b') == []
+
+
+def test_sent_nodes_are_not_materialized_again():
+    graph = AssignmentGraph()
+    assert defer(graph, 'ds.assign', toAssign='D$x + 1', newobj='a')
+    assert defer(graph, 'ds.assign', toAssign='a * 2', newobj='b')
+    sent = graph.send(graph.materialize({'a'}))
+    assert [output for output, _ in sent] == ['a']
+    assert graph.materialize() == ['b']
+    assert graph.send(['a', 'b']) == [('b', graph.nodes['b'])]
+    assert graph.get_status()['sending'] == ['a', 'b']
+
+
+def test_forget_succeeded_steps():
+    graph = AssignmentGraph()
+    assert defer(graph, 'ds.assign', toAssign='D$x + 1', newobj='a')
+    assert defer(graph, 'ds.assign', toAssign='a * 2', newobj='b')
+    assert defer(graph, 'ds.assign', toAssign='b * 2', newobj='c')
+    graph.forget(graph.send(graph.materialize()), 1)
+    assert graph.get_status()['pending'] == ['b', 'c']
+    assert graph.get_status()['sending'] == []
+    assert graph.materialized == 1
+    assert graph.materialize() == ['b', 'c']
+    graph.forget(graph.send(graph.materialize()), 2)
+    assert graph.nodes == {}
+    assert graph.materialized == 3
+
+
+def test_forget_keeps_nodes_replaced_while_sending():
+    graph = AssignmentGraph()
+    assert defer(graph, 'ds.assign', toAssign='D$x + 1', newobj='a')
+    sent = graph.send(graph.materialize())
+    assert defer(graph, 'ds.assign', toAssign='D$y + 1', newobj='a')
+    assert graph.dropped == 0
+    graph.forget(sent, 1)
+    assert expression(graph, 'a') == 'D$y + 1'
+    assert graph.materialize() == ['a']
+
+
+def test_clear():
+    graph = AssignmentGraph()
+    assert defer(graph, 'ds.assign', toAssign='D$x + 1', newobj='a')
+    assert defer(graph, 'ds.assign', toAssign='D$y + 1', newobj='b')
+    graph.clear()
+    assert graph.get_status()['pending'] == []
+    assert graph.dropped == 2
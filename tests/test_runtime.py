@@ -0,0 +1,22 @@
+from fdrtd.plugins.datashield import runtime
+
+
+def library(tmp_path, namespace):
+    (tmp_path / 'dsBaseClient').mkdir()
+    (tmp_path / 'dsBaseClient' / 'NAMESPACE').write_text(namespace)
+    return str(tmp_path)
+
+
+def test_exports_without_r(tmp_path, monkeypatch):
+    namespace = '# roxygen2\nexport(ds.mean)\nexport("ds.ls", ds.dim)\nimport(DSI)\n'
+    monkeypatch.setenv('R_LIBS', library(tmp_path, namespace))
+    monkeypatch.setenv('R_HOME', str(tmp_path / 'R'))
+    assert runtime.exports('dsBaseClient') == ['ds.mean', 'ds.ls', 'ds.dim']
+    assert runtime.exports('dsBase') is None
+    assert 'R' not in runtime.timings
+
+
+def test_exports_with_pattern(tmp_path, monkeypatch):
+    monkeypatch.setenv('R_LIBS', library(tmp_path, 'exportPattern("^ds\\\\.")\n'))
+    monkeypatch.setenv('R_HOME', str(tmp_path / 'R'))
+    assert runtime.exports('dsBaseClient') is None
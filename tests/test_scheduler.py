@@ -0,0 +1,73 @@
+from concurrent.futures import Future
+
+import pytest
+
+from fdrtd.plugins.datashield import scheduler
+
+
+class StubExecutor:
+
+    def __init__(self):
+        self.submitted = []
+
+    def submit(self, job, *args, console=None, pin=None, among=None):
+        future = Future()
+        future.set_running_or_notify_cancel()
+        self.submitted.append((job, future))
+        return future
+
+    def pinned_worker(self, pin):
+        return 0
+
+    def worker_index(self, future):
+        return 0
+
+    def cancel(self, future, reason):
+        return False
+
+    def finish_all(self):
+        jobs = []
+        while len(jobs) < len(self.submitted):
+            job, future = self.submitted[len(jobs)]
+            jobs.append(job)
+            future.set_result(None)
+        return jobs
+
+
+@pytest.fixture
+def executor(monkeypatch):
+    executor = StubExecutor()
+    monkeypatch.setattr(scheduler, 'get_executor', lambda: executor)
+    return executor
+
+
+def new_scheduler():
+    return scheduler.FairScheduler(100, 1, 1, {'interactive': 4, 'batch': 1})
+
+
+def test_calls_of_a_connection_run_in_order(executor):
+    fair = new_scheduler()
+    fair.submit('a', 'interactive', 'running')
+    for index in range(3):
+        fair.submit('a', 'batch', f'assign{index}')
+    fair.submit('a', 'interactive', 'mean')
+    assert executor.finish_all() == ['running', 'assign0', 'assign1', 'assign2', 'mean']
+
+
+def test_weights_apply_between_connections(executor):
+    fair = new_scheduler()
+    fair.submit('a', 'interactive', 'running')
+    for index in range(3):
+        fair.submit('a', 'batch', f'a{index}')
+    for index in range(3):
+        fair.submit('b', 'interactive', f'b{index}')
+    assert executor.finish_all() == ['running', 'b0', 'b1', 'b2', 'a0', 'a1', 'a2']
+
+
+def test_position(executor):
+    fair = new_scheduler()
+    fair.submit('a', 'interactive', 'running')
+    first = fair.submit('a', 'batch', 'first')
+    second = fair.submit('a', 'interactive', 'second')
+    assert fair.position(first)['position'] == 0
+    assert fair.position(second)['position'] == 1